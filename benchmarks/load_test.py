@@ -0,0 +1,234 @@
+"""Headless load test for decoder_universe.py.
+
+Simulated users each get their own streamlit.testing AppTest session and
+walk through the app at the same time:
+
+    dashboard  - first render of the dashboard
+    detail     - open a decoder
+    upgrade    - become a founding member
+    upload     - upload a document (read, instant scan)
+    analyze    - run the AI analysis against a local stub LLM until it finishes
+    back       - return to the dashboard
+
+Sessions share one mock Streamlit runtime, as they would on one server.
+AppTest cannot drive st.file_uploader in older Streamlit releases, so the script wrapper below makes
+the uploader return a document the harness placed in session state. Each
+step's latency is the time for its AppTest run, including any reruns the
+app triggers while polling a running analysis.
+
+Concurrency levels are run one after another; every level reports p50,
+p95 and p99 latency per step, errors, and process memory growth per
+session. The highest level whose dashboard and detail p95 stay within
+--max-slowdown times the single-user p95 is reported as sustainable.
+
+    python benchmarks/load_test.py --users 1,5,10,20 --latency-ms 500 --output load.json
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from pipeline_benchmark import MIME_TYPES, StubUpload, page_lines  # noqa: E402
+from stub_llm import quiet_streamlit_logging, start_stub_server, use_stub_llm  # noqa: E402
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "decoder_universe.py")
+STEPS = ("dashboard", "detail", "upgrade", "upload", "analyze", "back")
+RENDER_STEPS = ("dashboard", "detail")
+
+# Runs the real app, with the uploader answering from session state
+DRIVER_SCRIPT = """
+import runpy
+import streamlit as st
+
+if not getattr(st.file_uploader, "load_test_wrapper", False):
+    original_file_uploader = st.file_uploader
+
+    def file_uploader(*args, **kwargs):
+        if "load_test_uploads" in st.session_state:
+            return st.session_state["load_test_uploads"]
+        return original_file_uploader(*args, **kwargs)
+
+    file_uploader.load_test_wrapper = True
+    st.file_uploader = file_uploader
+
+runpy.run_path({app_path!r}, run_name="__main__")
+"""
+
+def install_shared_runtime():
+    """Give every AppTest session one mock Streamlit runtime, like sessions on one server
+
+    AppTest installs a fresh mock runtime for each run and removes it when the
+    run ends, which pulls it out from under sessions running in other threads.
+    """
+    from unittest.mock import MagicMock
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.testing.v1 import app_test
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    # AppTest's per-run runtime now lands on a subclass nothing reads from
+    app_test.Runtime = type("PerRunRuntime", (Runtime,), {})
+
+def synthetic_upload(user, pages):
+    """A TXT contract unique to each user so analyses are not served from the cache"""
+    import random
+
+    rng = random.Random(user)
+    lines = [f"Customer reference: load-test user {user}"]
+    for number in range(1, pages + 1):
+        lines += page_lines(rng, number, pages)
+    return StubUpload("\n".join(lines).encode("utf-8"), f"user_{user}_contract.txt", MIME_TYPES["txt"])
+
+def button(app, label_prefix=None, key=None):
+    for candidate in app.button:
+        if (key and candidate.key == key) or (label_prefix and candidate.label.startswith(label_prefix)):
+            return candidate
+    raise LookupError(f"button {key or label_prefix!r} not found")
+
+def simulate_user(user, args, decoder_key):
+    """Walk one session through the app, returning (step, seconds, error) tuples and the AppTest"""
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_string(DRIVER_SCRIPT.format(app_path=APP_PATH), default_timeout=args.timeout)
+    steps = [
+        ("dashboard", lambda: app.run()),
+        ("detail", lambda: button(app, key=f"btn_{decoder_key}").click().run()),
+        ("upgrade", lambda: button(app, label_prefix="🌟 Become Founding Member").click().run()),
+        ("upload", lambda: (app.session_state.__setitem__("load_test_uploads", [synthetic_upload(user, args.pages)]), app.run())),
+        ("analyze", lambda: button(app, label_prefix="🔍 Analyze Document").click().run()),
+        ("back", lambda: button(app, key="back_btn").click().run()),
+    ]
+
+    records = []
+    for step, action in steps:
+        time.sleep(args.think_time)
+        started = time.perf_counter()
+        try:
+            action()
+            error = "; ".join(str(exception.value) for exception in app.exception) or None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        records.append((step, time.perf_counter() - started, error))
+        if error:
+            break
+    return records, app
+
+def resident_memory_bytes():
+    """Current RSS where /proc is available, otherwise the peak RSS"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+def run_level(users, args, decoder_key):
+    memory_before = resident_memory_bytes()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        # Stagger session starts slightly, like users arriving
+        futures = []
+        for user in range(users):
+            futures.append(executor.submit(simulate_user, f"{users}-{user}", args, decoder_key))
+            time.sleep(args.ramp_up / max(users, 1))
+        outcomes = [future.result() for future in futures]
+    # Sessions are still referenced here, so their state counts towards memory
+    memory_after = resident_memory_bytes()
+
+    timings = {step: [] for step in STEPS}
+    errors = []
+    for records, _ in outcomes:
+        for step, seconds, error in records:
+            if error:
+                errors.append(f"{step}: {error}")
+            else:
+                timings[step].append(seconds)
+
+    level = {"users": users, "errors": errors, "memory_per_session_bytes": (memory_after - memory_before) / users, "steps": {}}
+    for step, values in timings.items():
+        if values:
+            level["steps"][step] = {
+                "count": len(values),
+                "p50_seconds": statistics.median(values),
+                "p95_seconds": percentile(values, 0.95),
+                "p99_seconds": percentile(values, 0.99),
+                "max_seconds": max(values),
+            }
+    return level
+
+def sustainable_users(levels, max_slowdown):
+    """Largest level whose render steps stay within max_slowdown of the first level's p95"""
+    baseline = levels[0]["steps"]
+    sustainable = None
+    for level in levels:
+        if level["errors"]:
+            break
+        if any(
+            step in baseline and level["steps"].get(step, {}).get("p95_seconds", float("inf")) > baseline[step]["p95_seconds"] * max_slowdown
+            for step in RENDER_STEPS
+        ):
+            break
+        sustainable = level["users"]
+    return sustainable
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=lambda value: [int(item) for item in value.split(",") if item],
+                        default=[1, 5, 10, 20], help="concurrency levels to run, in order")
+    parser.add_argument("--decoder", default="car_salesman", help="decoder the simulated users open")
+    parser.add_argument("--pages", type=int, default=5, help="pages in each simulated upload")
+    parser.add_argument("--latency-ms", type=float, default=500, help="stub LLM delay before each response")
+    parser.add_argument("--token-delay-ms", type=float, default=5, help="stub LLM delay between streamed deltas")
+    parser.add_argument("--think-time", type=float, default=0.2, help="seconds each user waits between steps")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="seconds over which a level's sessions start")
+    parser.add_argument("--timeout", type=float, default=120, help="AppTest timeout per step")
+    parser.add_argument("--max-slowdown", type=float, default=2.0, help="allowed p95 slowdown of render steps")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.latency_ms / 1000, args.token_delay_ms / 1000)
+    use_stub_llm(f"http://127.0.0.1:{server.server_address[1]}/v1", "load-test")
+    install_shared_runtime()
+    quiet_streamlit_logging()
+
+    # One untimed session first so imports and caches don't count against the first level
+    simulate_user("warm-up", args, args.decoder)
+
+    levels = []
+    for users in args.users:
+        level = run_level(users, args, args.decoder)
+        levels.append(level)
+        summary = "  ".join(
+            f"{step} p50 {timing['p50_seconds'] * 1000:.0f} / p95 {timing['p95_seconds'] * 1000:.0f} ms"
+            for step, timing in level["steps"].items()
+        )
+        print(f"{users:4} users  {summary}  {level['memory_per_session_bytes'] / 1024 / 1024:.1f} MB/session  "
+              f"{len(level['errors'])} errors", file=sys.stderr)
+    server.shutdown()
+
+    result = {
+        "settings": {name: getattr(args, name) for name in ("decoder", "pages", "latency_ms", "think_time", "max_slowdown")},
+        "levels": levels,
+        "sustainable_users": sustainable_users(levels, args.max_slowdown),
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(result, output_file, indent=2)
+    return 1 if any(level["errors"] for level in levels) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""Offline benchmark for the document extraction and analysis pipeline.
+
+Generates a synthetic corpus of PDF, DOCX and TXT documents (1 to 1000
+pages by default), starts a local stub of the OpenAI chat completions
+endpoint with configurable latency and runs each pipeline stage against
+every document:
+
+    extract  - read_uploaded_document with the extraction cache cleared
+    trim     - prepare_document_for_prompt (normalization and token budget)
+    prescan  - scan_document_for_red_flags
+    analyze  - analyze_document_with_ai with the analysis cache disabled
+    stream   - the streamed analysis used by the app, including time to first token
+
+For each stage it reports p50/p95 latency, pages per second, peak traced
+memory and the number of memory blocks the stage left allocated. Memory
+is measured in a separate tracemalloc run so tracing does not skew the
+timings; work done in the extraction process pool is not traced.
+
+    python benchmarks/pipeline_benchmark.py --sizes 1,10,100 --output pipeline.json
+    python benchmarks/pipeline_benchmark.py --baseline pipeline.json --tolerance 0.25
+
+With --baseline the exit status is 1 when any stage's p50 latency
+regresses by more than the tolerance.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from stub_llm import quiet_streamlit_logging, start_stub_server, use_stub_llm
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ("extract", "trim", "prescan", "analyze", "stream")
+FORMATS = ("pdf", "docx", "txt")
+MIME_TYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "txt": "text/plain",
+}
+LINES_PER_PAGE = 40
+
+# Contract-like filler with the fees and phrases the decoders look for
+CLAUSES = [
+    "Buyer agrees to pay a documentation fee of ${amount} at signing.",
+    "Dealer preparation and handling charges of ${amount} are non-refundable.",
+    "An annual advisory fee of {percent}% of assets under management applies.",
+    "Surrender charges apply to withdrawals in the first {years} years.",
+    "This offer expires today and cannot be held without a deposit of ${amount}.",
+    "Protection package including VIN etching and fabric coating: ${amount}.",
+    "Basic services of funeral director and staff: ${amount}.",
+    "Buyer acknowledges that all add-ons were explained and accepted voluntarily.",
+    "Financing is subject to credit approval; the rate may change after delivery.",
+    "Commission paid to the agent is {percent}% of the sale price.",
+]
+def page_lines(rng, number, total):
+    lines = ["ACME MOTORS - RETAIL BUYER ORDER"]
+    for _ in range(LINES_PER_PAGE - 2):
+        lines.append(rng.choice(CLAUSES).format(
+            amount=f"{rng.randint(49, 4999):,}", percent=rng.choice([1, 1.5, 2, 3, 6]), years=rng.randint(3, 10)
+        ))
+    lines.append(f"Page {number} of {total}")
+    return lines
+
+def pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def build_pdf(pages):
+    """Minimal PDF with one Helvetica text stream per page"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for lines in pages:
+        stream = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return output.getvalue()
+
+def build_docx(pages):
+    import docx
+
+    document = docx.Document()
+    for number, lines in enumerate(pages):
+        if number:
+            document.add_page_break()
+        for line in lines:
+            document.add_paragraph(line)
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+def build_txt(pages):
+    return "\n\n".join("\n".join(lines) for lines in pages).encode("utf-8")
+
+BUILDERS = {"pdf": build_pdf, "docx": build_docx, "txt": build_txt}
+
+def corpus_document(corpus_dir, file_format, pages):
+    """Bytes of the synthetic document, generated once and reused between runs"""
+    path = os.path.join(corpus_dir, f"{pages}_pages.{file_format}")
+    if not os.path.exists(path):
+        rng = random.Random(pages)
+        data = BUILDERS[file_format]([page_lines(rng, number, pages) for number in range(1, pages + 1)])
+        os.makedirs(corpus_dir, exist_ok=True)
+        with open(path, "wb") as document_file:
+            document_file.write(data)
+    with open(path, "rb") as document_file:
+        return document_file.read()
+
+class StubUpload(io.BytesIO):
+    """Stands in for Streamlit's UploadedFile"""
+
+    def __init__(self, data, name, file_type):
+        super().__init__(data)
+        self.name = name
+        self.type = file_type
+        self.size = len(data)
+
+def load_app(stub_url):
+    """Import the app against the stub endpoint with the analysis cache and result store disabled"""
+    use_stub_llm(stub_url, "benchmark", ANALYSIS_CACHE_MEMORY_MB="0")
+    sys.path.insert(0, REPO_DIR)
+    import decoder_universe
+
+    quiet_streamlit_logging()
+    return decoder_universe
+
+def stage_runners(app, data, file_format, decoder_type):
+    """One zero-argument callable per stage; text stages reuse a single extraction"""
+    upload = StubUpload(data, f"benchmark.{file_format}", MIME_TYPES[file_format])
+    text = app.read_uploaded_document(upload)["text"]
+
+    def extract():
+        app.extract_document_text.clear()
+        return app.read_uploaded_document(upload)
+
+    def stream():
+        analysis = app.analyze_document_with_ai(text, decoder_type, stream=True)
+        for _ in analysis:
+            pass
+        return analysis
+
+    return {
+        "extract": extract,
+        "trim": lambda: app.prepare_document_for_prompt(text, decoder_type),
+        "prescan": lambda: app.scan_document_for_red_flags(text, [decoder_type]),
+        "analyze": lambda: app.analyze_document_with_ai(text, decoder_type),
+        "stream": stream,
+    }
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+def measure(run, iterations):
+    timings = []
+    first_token = []
+    # Warm-up run so client creation and regex compilation are not timed
+    run()
+    for _ in range(iterations):
+        started = time.perf_counter()
+        result = run()
+        timings.append(time.perf_counter() - started)
+        if getattr(result, "time_to_first_token", None) is not None:
+            first_token.append(result.time_to_first_token)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    # Snapshots only see live blocks, so this counts what the stage left allocated, not every allocation it made
+    retained = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+
+    measurement = {
+        "p50_seconds": statistics.median(timings),
+        "p95_seconds": percentile(timings, 0.95),
+        "peak_memory_bytes": peak,
+        "retained_blocks": retained,
+    }
+    if first_token:
+        measurement["p50_time_to_first_token_seconds"] = statistics.median(first_token)
+    return measurement
+
+def run_benchmark(app, args):
+    results = []
+    for file_format in args.formats:
+        for pages in args.sizes:
+            data = corpus_document(args.corpus_dir, file_format, pages)
+            runners = stage_runners(app, data, file_format, args.decoder)
+            for stage in args.stages:
+                measurement = measure(runners[stage], args.iterations)
+                measurement.update({
+                    "stage": stage,
+                    "format": file_format,
+                    "pages": pages,
+                    "bytes": len(data),
+                    "pages_per_second": pages / measurement["p50_seconds"] if measurement["p50_seconds"] else None,
+                })
+                results.append(measurement)
+                print(
+                    f"{stage:8} {file_format:4} {pages:5} pages  p50 {measurement['p50_seconds'] * 1000:9.1f} ms  "
+                    f"p95 {measurement['p95_seconds'] * 1000:9.1f} ms  peak {measurement['peak_memory_bytes'] / 1024 / 1024:7.1f} MB  "
+                    f"retained blocks {measurement['retained_blocks']:8}",
+                    file=sys.stderr
+                )
+    return results
+
+def compare_to_baseline(results, baseline, tolerance):
+    previous = {(entry["stage"], entry["format"], entry["pages"]): entry for entry in baseline["results"]}
+    failures = []
+    for entry in results:
+        old = previous.get((entry["stage"], entry["format"], entry["pages"]))
+        if old and entry["p50_seconds"] > old["p50_seconds"] * (1 + tolerance):
+            failures.append(
+                f"{entry['stage']} {entry['format']} {entry['pages']} pages: "
+                f"p50 {entry['p50_seconds']:.3f}s vs baseline {old['p50_seconds']:.3f}s"
+            )
+    return failures
+
+def comma_list(convert=str):
+    return lambda value: [convert(item) for item in value.split(",") if item]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=comma_list(int), default=[1, 10, 100, 1000], help="document page counts")
+    parser.add_argument("--formats", type=comma_list(), default=list(FORMATS), help="document formats (pdf,docx,txt)")
+    parser.add_argument("--stages", type=comma_list(), default=list(STAGES), help="stages to measure")
+    parser.add_argument("--decoder", default="car_salesman", help="decoder used for trimming, scanning and analysis")
+    parser.add_argument("--iterations", type=int, default=3, help="timed runs per stage and document")
+    parser.add_argument("--latency-ms", type=float, default=200, help="stub API delay before each response")
+    parser.add_argument("--token-delay-ms", type=float, default=2, help="stub API delay between streamed deltas")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "decoder_universe_corpus"),
+                        help="where generated documents are kept between runs")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown of p50 latency")
+    args = parser.parse_args()
+    for name, allowed in (("formats", FORMATS), ("stages", STAGES)):
+        unknown = set(getattr(args, name)) - set(allowed)
+        if unknown:
+            parser.error(f"unknown {name}: {', '.join(sorted(unknown))}")
+
+    server = start_stub_server(args.latency_ms / 1000, args.token_delay_ms / 1000)
+    app = load_app(f"http://127.0.0.1:{server.server_address[1]}/v1")
+    summary = {
+        "settings": {
+            "latency_ms": args.latency_ms,
+            "token_delay_ms": args.token_delay_ms,
+            "iterations": args.iterations,
+            "decoder": args.decoder,
+        },
+        "results": run_benchmark(app, args),
+    }
+    server.shutdown()
+
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(summary, output_file, indent=2)
+
+    failures = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            failures = compare_to_baseline(summary["results"], json.load(baseline_file), args.tolerance)
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
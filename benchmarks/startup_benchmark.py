@@ -0,0 +1,92 @@
+"""Cold-start benchmark for decoder_universe.py.
+
+Each run starts a fresh Python process, imports Streamlit, renders the
+dashboard once with streamlit.testing's AppTest and reports how long each
+step took, plus which heavy optional dependencies were imported on the way
+(they should only load when a document is analyzed).
+
+    python benchmarks/startup_benchmark.py --runs 5 --output startup.json
+    python benchmarks/startup_benchmark.py --baseline startup.json --tolerance 0.25
+
+With --baseline the exit status is 1 when the median first-render time
+regresses by more than the tolerance, or when a heavy module is loaded
+during startup.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "decoder_universe.py")
+HEAVY_MODULES = ("PyPDF2", "docx", "openai", "httpx")
+
+CHILD_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+app = AppTest.from_file(sys.argv[1], default_timeout=120)
+app.run()
+rendered = time.perf_counter()
+print(json.dumps({
+    "streamlit_import_seconds": imported - started,
+    "first_render_seconds": rendered - imported,
+    "total_seconds": rendered - started,
+    "exceptions": [str(exception.value) for exception in app.exception],
+    "heavy_modules_loaded": [name for name in sys.argv[2:] if name in sys.modules],
+}))
+"""
+
+def run_once(app_path):
+    """Measure one cold start in a fresh interpreter"""
+    completed = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, app_path, *HEAVY_MODULES],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def summarize(runs):
+    summary = {"runs": len(runs)}
+    for metric in ("streamlit_import_seconds", "first_render_seconds", "total_seconds"):
+        values = [run[metric] for run in runs]
+        summary[metric] = {"median": statistics.median(values), "min": min(values), "max": max(values)}
+    summary["heavy_modules_loaded"] = sorted({name for run in runs for name in run["heavy_modules_loaded"]})
+    summary["exceptions"] = sorted({message for run in runs for message in run["exceptions"]})
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default=APP_PATH, help="Streamlit script to benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="number of cold starts to measure")
+    parser.add_argument("--output", help="write the summary as JSON to this file")
+    parser.add_argument("--baseline", help="summary JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown of median first render")
+    args = parser.parse_args()
+
+    summary = summarize([run_once(args.app) for _ in range(args.runs)])
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(summary, output_file, indent=2)
+
+    failures = []
+    if summary["exceptions"]:
+        failures.append(f"app raised during startup: {summary['exceptions']}")
+    if summary["heavy_modules_loaded"]:
+        failures.append(f"heavy modules imported at startup: {summary['heavy_modules_loaded']}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        current = summary["first_render_seconds"]["median"]
+        previous = baseline["first_render_seconds"]["median"]
+        if current > previous * (1 + args.tolerance):
+            failures.append(f"median first render {current:.3f}s vs baseline {previous:.3f}s")
+
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
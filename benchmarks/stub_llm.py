@@ -0,0 +1,100 @@
+"""Local stand-in for the OpenAI chat completions API, shared by the benchmarks.
+
+The stub answers every prompt with the same JSON-lines analysis after a
+configurable delay, streamed or not. use_stub_llm points the app at it
+with the persistent stores disabled, so runs neither reuse earlier
+results nor leave files behind.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_ANALYSIS = "\n".join(json.dumps(item) for item in [
+    {"type": "summary", "text": "Buyer order with several dealer-added charges."},
+    {"type": "fee", "item": "Documentation fee", "amount": 799, "quote": "documentation fee"},
+    {"type": "conflict", "description": "Commission tied to add-on products", "quote": ""},
+    {"type": "red_flag", "description": "Pressure to sign today", "severity": "high", "quote": ""},
+    {"type": "recommendation", "text": "Ask for an itemized out-the-door price in writing"},
+]) + "\n"
+
+class StubCompletionsHandler(BaseHTTPRequestHandler):
+    """Answers /chat/completions like the OpenAI API after a fixed delay"""
+
+    protocol_version = "HTTP/1.1"
+    latency = 0.2
+    token_delay = 0.002
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.latency)
+        usage = {
+            "prompt_tokens": sum(len(message["content"]) for message in body["messages"]) // 4,
+            "completion_tokens": len(STUB_ANALYSIS) // 4,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()), "model": body["model"]}
+
+        if not body.get("stream"):
+            self.send_json(dict(base, object="chat.completion", usage=usage, choices=[{
+                "index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": STUB_ANALYSIS}
+            }]))
+            return
+
+        events = [dict(base, object="chat.completion.chunk", choices=[{
+            "index": 0, "finish_reason": None, "delta": {"content": word}
+        }]) for word in STUB_ANALYSIS.split(" ")]
+        for event in events[:-1]:
+            event["choices"][0]["delta"]["content"] += " "
+        events.append(dict(base, object="chat.completion.chunk", choices=[], usage=usage))
+        payload = [f"data: {json.dumps(event)}\n\n".encode() for event in events] + [b"data: [DONE]\n\n"]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(sum(len(part) for part in payload)))
+        self.end_headers()
+        for part in payload:
+            self.wfile.write(part)
+            self.wfile.flush()
+            time.sleep(self.token_delay)
+
+    def send_json(self, data):
+        encoded = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server(latency, token_delay):
+    handler = type("Handler", (StubCompletionsHandler,), {"latency": latency, "token_delay": token_delay})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def use_stub_llm(base_url, api_key, **settings):
+    """Configure the app, through its environment, to analyze with the stub; extra settings are added as given"""
+    os.environ.update({
+        "OPENAI_API_KEY": api_key,
+        "OPENAI_BASE_URL": base_url,
+        "ANALYSIS_CACHE_PATH": "",
+        "ANALYSIS_RESULTS_PATH": "",
+        "ANALYSIS_HISTORY_PATH": "",
+        # The stub has no rate limits; the scheduler's defaults would turn latencies into queue waits
+        "OPENAI_REQUESTS_PER_MINUTE": "1000000000",
+        "OPENAI_TOKENS_PER_MINUTE": "1000000000",
+        **settings,
+    })
+
+def quiet_streamlit_logging():
+    """Bare-mode Streamlit warns about the missing script run context on every call"""
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit"):
+            logging.getLogger(name).setLevel(logging.ERROR)
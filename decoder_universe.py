@@ -1,8 +1,33 @@
 import streamlit as st
 from datetime import datetime
-import PyPDF2
-import docx
-from openai import OpenAI
+from collections import Counter, OrderedDict, deque, namedtuple
+from collections.abc import Mapping
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import contextvars
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+
+# PyPDF2, docx, openai and httpx are imported inside the extraction and analysis
+# functions so free users and cold starts don't pay for them
 
 # Page configuration
 st.set_page_config(
@@ -12,298 +37,2690 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Custom CSS for professional styling
-st.markdown("""
-<style>
-    .main-header {
-        text-align: center;
-        padding: 2rem 0;
-        background: linear-gradient(90deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        margin: -1rem -1rem 2rem -1rem;
-        border-radius: 0 0 15px 15px;
-    }
+# App URLs for premium access
+PREMIUM_APP_URLS = {
+    "financial_advisor": "https://advisor-decoder-g33giprnbapgqxybkgxk5h.streamlit.app/",
+    "car_salesman": "https://car-salesman-decoder-tiye3psbwpspizha8kta8o.streamlit.app/",
+    "real_estate": "https://real-estate-agent-decoder-cqunc4r2zarq4rtqkej7bh.streamlit.app/",
+    "funeral_director": "https://funeral-home-decoder-p6bfaya2wqy4wgzoxrsa48.streamlit.app/"
+}
+
+# Custom CSS for professional styling, served as a browser-cached stylesheet
+STYLESHEET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "decoder_universe.css")
+STYLESHEET_URL = "app/static/decoder_universe.css"
+
+def get_setting(name, default=None):
+    """Read an optional setting from Streamlit secrets, falling back to the environment"""
+    try:
+        if name in st.secrets:
+            return st.secrets[name]
+    except Exception:
+        # No secrets.toml configured
+        pass
+    return os.environ.get(name, default)
+
+@st.cache_data(show_spinner=False)
+def load_stylesheet(mtime):
+    """Stylesheet text and a short content hash for cache busting, read once per file version"""
+    with open(STYLESHEET_PATH, encoding="utf-8") as stylesheet:
+        css = stylesheet.read()
+    return css, hashlib.sha256(css.encode("utf-8")).hexdigest()[:12]
+
+def inject_stylesheet():
+    """Link the app stylesheet so browsers cache it instead of receiving the CSS on every rerun
+    
+    Needs server.enableStaticServing (set in .streamlit/config.toml); INLINE_CSS=1 embeds it instead.
+    """
+    css, version = load_stylesheet(os.stat(STYLESHEET_PATH).st_mtime)
+    if str(get_setting("INLINE_CSS", "")).lower() in ("1", "true", "yes"):
+        st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
+    else:
+        st.markdown(f'<link rel="stylesheet" href="{STYLESHEET_URL}?v={version}">', unsafe_allow_html=True)
+
+class PipelineMetrics:
+    """Thread-safe counters and per-stage latency histograms for the analysis pipeline"""
+    
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    
+    def __init__(self):
+        self.started_at = time.time()
+        self._counters = {}  # (name, labels) -> value
+        self._latencies = {}  # (stage, labels) -> [count, total, max, bucket counts]
+        self._lock = threading.Lock()
+    
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def observe(self, stage, seconds, **labels):
+        key = (stage, tuple(sorted(labels.items())))
+        with self._lock:
+            summary = self._latencies.setdefault(key, [0, 0.0, 0.0, [0] * len(self.LATENCY_BUCKETS)])
+            summary[0] += 1
+            summary[1] += seconds
+            summary[2] = max(summary[2], seconds)
+            for i, bound in enumerate(self.LATENCY_BUCKETS):
+                if seconds <= bound:
+                    summary[3][i] += 1
+    
+    @contextmanager
+    def timed(self, stage, **labels):
+        """Record the duration of the with-block, including when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, **labels)
+    
+    def snapshot(self):
+        """JSON-friendly dump of every counter and latency summary"""
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            latencies = [{"stage": stage, "labels": dict(labels), "count": count,
+                          "mean_seconds": total / count, "max_seconds": maximum}
+                         for (stage, labels), (count, total, maximum, _) in sorted(self._latencies.items())]
+        
+        hits = sum(c["value"] for c in counters if c["name"] == "analysis_cache_hits")
+        misses = sum(c["value"] for c in counters if c["name"] == "analysis_cache_misses")
+        return {
+            "uptime_seconds": time.time() - self.started_at,
+            "analysis_cache_hit_rate": hits / (hits + misses) if hits + misses else None,
+            "counters": counters,
+            "latencies": latencies
+        }
     
-    .decoder-card {
-        background: white;
-        padding: 1.5rem;
-        border-radius: 15px;
-        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-        border: 1px solid #e0e0e0;
-        transition: transform 0.2s ease, box-shadow 0.2s ease;
-        cursor: pointer;
-        margin-bottom: 1rem;
-        height: 200px;
-        display: flex;
-        flex-direction: column;
-        justify-content: space-between;
-    }
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        def format_labels(labels):
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+        
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(f"decoder_universe_{name}_total{format_labels(labels)} {value}")
+            for (stage, labels), (count, total, _, buckets) in sorted(self._latencies.items()):
+                stage_labels = (("stage", stage),) + labels
+                for bound, bucket_count in zip(self.LATENCY_BUCKETS, buckets):
+                    lines.append(f"decoder_universe_stage_seconds_bucket{format_labels(stage_labels + (('le', bound),))} {bucket_count}")
+                lines.append(f"decoder_universe_stage_seconds_bucket{format_labels(stage_labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"decoder_universe_stage_seconds_sum{format_labels(stage_labels)} {total}")
+                lines.append(f"decoder_universe_stage_seconds_count{format_labels(stage_labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+@st.cache_resource
+def get_pipeline_metrics():
+    """Process-wide metrics shared by every session and background worker"""
+    return PipelineMetrics()
+
+@st.cache_resource
+def start_metrics_server(host, port):
+    """Serve /metrics (Prometheus text) and /metrics.json from a background thread"""
+    metrics = get_pipeline_metrics()
+    
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(metrics.snapshot()), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.end_headers()
+            self.wfile.write(body.encode("utf-8"))
+        
+        def log_message(self, format, *args):
+            pass
     
-    .decoder-card:hover {
-        transform: translateY(-5px);
-        box-shadow: 0 8px 25px rgba(0, 0, 0, 0.15);
-    }
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+# Versioned content (decoders, prompts, legal pages) lives in JSON files under content/
+DEFAULT_CONTENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "content")
+CONTENT_SCHEMA_VERSION = 1
+CONTENT_RELOAD_CHECK_SECONDS = 2
+
+DECODER_TEXT_FIELDS = ("name", "icon", "description")
+DECODER_LIST_FIELDS = ("preview_tactics", "premium_tactics", "preview_tips", "premium_tips", "preview_flags", "premium_flags")
+
+SCAN_SEVERITIES = ("high", "medium", "low")
+SEVERITY_ICONS = {"high": "🔴", "medium": "🟠", "low": "🟡"}
+MODEL_SETTING_TYPES = {"model": str, "max_tokens": int, "temperature": (int, float)}
+
+class ContentError(ValueError):
+    """A content file is missing, malformed or fails schema validation"""
+
+def require_fields(data, fields, expected_type, source):
+    """Check that every field is present with the expected type (lists must hold strings)"""
+    if not isinstance(data, dict):
+        raise ContentError(f"{source}: expected an object")
+    for field in fields:
+        value = data.get(field)
+        if not isinstance(value, expected_type):
+            raise ContentError(f"{source}: '{field}' must be a {expected_type.__name__}")
+        if expected_type is list and not all(isinstance(item, str) for item in value):
+            raise ContentError(f"{source}: '{field}' must only contain strings")
+
+def validate_manifest(data, source):
+    require_fields(data, ("schema_version",), int, source)
+    if data["schema_version"] != CONTENT_SCHEMA_VERSION:
+        raise ContentError(f"{source}: unsupported schema_version {data['schema_version']}")
+    require_fields(data, ("content_version",), str, source)
+    require_fields(data, ("decoders",), list, source)
+    if not isinstance(data.get("coming_soon"), list):
+        raise ContentError(f"{source}: 'coming_soon' must be a list")
+    for index, entry in enumerate(data["coming_soon"]):
+        require_fields(entry, DECODER_TEXT_FIELDS, str, f"{source} coming_soon[{index}]")
+
+def validate_decoder(data, source):
+    require_fields(data, DECODER_TEXT_FIELDS, str, source)
+    require_fields(data, ("is_available",), bool, source)
+    require_fields(data, DECODER_LIST_FIELDS, list, source)
+    
+    # Optional regex rules for the local red-flag scanner
+    if not isinstance(data.get("scan_patterns", []), list):
+        raise ContentError(f"{source}: 'scan_patterns' must be a list")
+    for index, rule in enumerate(data.get("scan_patterns", [])):
+        require_fields(rule, ("pattern", "label", "severity"), str, f"{source} scan_patterns[{index}]")
+        if rule["severity"] not in SCAN_SEVERITIES:
+            raise ContentError(f"{source} scan_patterns[{index}]: severity must be one of {', '.join(SCAN_SEVERITIES)}")
+        try:
+            re.compile(rule["pattern"])
+        except re.error as e:
+            raise ContentError(f"{source} scan_patterns[{index}]: invalid pattern ({e})")
+
+def validate_prompts(data, source):
+    require_fields(data, ("version", "reduce"), str, source)
+    if "{partials}" not in data["reduce"]:
+        raise ContentError(f"{source}: the reduce prompt needs a {{partials}} placeholder")
+    # Optional instructions appended to every analysis prompt, describing the JSON lines to return
+    if not isinstance(data.get("output_format", ""), str):
+        raise ContentError(f"{source}: 'output_format' must be a string")
+    if not isinstance(data.get("decoders"), dict) or not data["decoders"]:
+        raise ContentError(f"{source}: 'decoders' must be a non-empty object")
+    for decoder_type, prompt in data["decoders"].items():
+        if not isinstance(prompt, str) or "{document}" not in prompt:
+            raise ContentError(f"{source}: prompt '{decoder_type}' needs a {{document}} placeholder")
+    
+    # Optional per-decoder cap on document tokens sent for analysis
+    budgets = data.get("token_budgets", {})
+    if not isinstance(budgets, dict) or not all(isinstance(budget, int) and budget > 0 for budget in budgets.values()):
+        raise ContentError(f"{source}: 'token_budgets' must map decoder types to positive integers")
+    
+    # Optional model settings: defaults, per-decoder overrides and a route for short documents
+    models = data.get("models", {})
+    if not isinstance(models, dict):
+        raise ContentError(f"{source}: 'models' must be an object")
+    overrides = [("default", models.get("default", {})), ("short_documents", models.get("short_documents", {}))]
+    if not isinstance(models.get("decoders", {}), dict):
+        raise ContentError(f"{source}: 'models.decoders' must be an object")
+    overrides += [(f"decoders.{decoder_type}", override) for decoder_type, override in models.get("decoders", {}).items()]
+    for name, override in overrides:
+        if not isinstance(override, dict):
+            raise ContentError(f"{source}: 'models.{name}' must be an object")
+        for field, value in override.items():
+            if field == "max_document_tokens" and name == "short_documents":
+                valid = isinstance(value, int) and value > 0
+            else:
+                valid = field in MODEL_SETTING_TYPES and isinstance(value, MODEL_SETTING_TYPES[field]) and not isinstance(value, bool)
+            if not valid:
+                raise ContentError(f"{source}: invalid setting 'models.{name}.{field}'")
+    if models.get("short_documents") and "max_document_tokens" not in models["short_documents"]:
+        raise ContentError(f"{source}: 'models.short_documents' needs max_document_tokens")
+
+def validate_legal_page(data, source):
+    require_fields(data, ("title",), str, source)
+    if "tabs" in data:
+        if not isinstance(data["tabs"], list):
+            raise ContentError(f"{source}: 'tabs' must be a list")
+        for index, tab in enumerate(data["tabs"]):
+            require_fields(tab, ("label", "body"), str, f"{source} tabs[{index}]")
+    else:
+        require_fields(data, ("body",), str, source)
+
+class ContentStore:
+    """Loads content files lazily, parses each once and reloads it when its mtime changes"""
+    
+    def __init__(self, root, check_interval=CONTENT_RELOAD_CHECK_SECONDS):
+        self.root = root
+        self.check_interval = check_interval
+        self._files = {}  # relative path -> [mtime, checked_at, parsed value]
+        self._lock = threading.Lock()
+    
+    def load(self, relative_path, validator):
+        """Parsed and validated content of one file; a broken edit keeps serving the last good version"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._files.get(relative_path)
+            if entry is not None and now - entry[1] < self.check_interval:
+                return entry[2]
+            
+            try:
+                path = os.path.join(self.root, relative_path)
+                mtime = os.stat(path).st_mtime
+                if entry is not None and entry[0] == mtime:
+                    entry[1] = now
+                    return entry[2]
+                with open(path, encoding="utf-8") as content_file:
+                    value = json.load(content_file)
+                validator(value, relative_path)
+            except (OSError, ValueError) as e:
+                if entry is None:
+                    raise ContentError(f"Could not load {relative_path}: {e}") from e
+                get_pipeline_metrics().increment("errors", stage="content", error=type(e).__name__)
+                entry[1] = now
+                return entry[2]
+            
+            self._files[relative_path] = [mtime, now, value]
+            return value
     
-    .premium-badge {
-        background: linear-gradient(45deg, #FFD700, #FFA500);
-        color: #333;
-        padding: 0.2rem 0.6rem;
-        border-radius: 12px;
-        font-size: 0.8rem;
-        font-weight: bold;
-        margin-bottom: 0.5rem;
-        display: inline-block;
-    }
+    def version(self, relative_path):
+        """Modification time of the loaded file, used to key caches built from it"""
+        with self._lock:
+            return self._files[relative_path][0]
     
-    .preview-badge {
-        background: #28a745;
-        color: white;
-        padding: 0.2rem 0.6rem;
-        border-radius: 12px;
-        font-size: 0.8rem;
-        font-weight: bold;
-        margin-bottom: 0.5rem;
-        display: inline-block;
-    }
+    def manifest(self):
+        return self.load("manifest.json", validate_manifest)
     
-    .coming-soon-badge {
-        background: #6c757d;
-        color: white;
-        padding: 0.2rem 0.6rem;
-        border-radius: 12px;
-        font-size: 0.8rem;
-        font-weight: bold;
-        margin-bottom: 0.5rem;
-        display: inline-block;
-    }
+    def decoder(self, decoder_key):
+        return self.load(os.path.join("decoders", f"{decoder_key}.json"), validate_decoder)
     
-    .card-icon {
-        font-size: 2.5rem;
-        text-align: center;
-        margin-bottom: 1rem;
-    }
+    def decoder_version(self, decoder_key):
+        self.decoder(decoder_key)
+        return self.version(os.path.join("decoders", f"{decoder_key}.json"))
     
-    .card-title {
-        font-size: 1.3rem;
-        font-weight: bold;
-        color: #333;
-        text-align: center;
-        margin-bottom: 0.5rem;
-    }
+    def prompts(self):
+        return self.load("prompts.json", validate_prompts)
     
-    .card-description {
-        font-size: 0.9rem;
-        color: #666;
-        text-align: center;
-        line-height: 1.4;
-    }
+    def legal_page(self, name):
+        return self.load(os.path.join("legal", f"{name}.json"), validate_legal_page)
     
-    .premium-overlay {
-        background: rgba(255, 215, 0, 0.1);
-        border: 2px solid #FFD700;
-        border-radius: 15px;
-        padding: 1rem;
-        margin: 1rem 0;
-    }
+    def legal_page_version(self, name):
+        self.legal_page(name)
+        return self.version(os.path.join("legal", f"{name}.json"))
+
+class DecoderCatalog(Mapping):
+    """Read-only decoder_key -> decoder mapping in manifest order, loading each decoder file on first access"""
     
-    .tactic-warning {
-        background: #fff3cd;
-        border: 1px solid #ffeaa7;
-        padding: 1rem;
-        border-radius: 8px;
-        margin: 1rem 0;
-    }
+    def __init__(self, store):
+        self._store = store
     
-    .protection-tip {
-        background: #d1ecf1;
-        border: 1px solid #bee5eb;
-        padding: 1rem;
-        border-radius: 8px;
-        margin: 1rem 0;
-    }
+    def __getitem__(self, decoder_key):
+        if decoder_key not in self._store.manifest()["decoders"]:
+            raise KeyError(decoder_key)
+        return self._store.decoder(decoder_key)
     
-    .red-flag {
-        background: #f8d7da;
-        border: 1px solid #f5c6cb;
-        padding: 1rem;
-        border-radius: 8px;
-        margin: 1rem 0;
-    }
+    def __iter__(self):
+        return iter(self._store.manifest()["decoders"])
     
-    .upgrade-cta {
-        background: linear-gradient(45deg, #667eea, #764ba2);
-        color: white;
-        padding: 1.5rem;
-        border-radius: 12px;
-        text-align: center;
-        margin: 2rem 0;
-        box-shadow: 0 4px 15px rgba(102, 126, 234, 0.3);
-    }
-</style>
-""", unsafe_allow_html=True)
+    def __len__(self):
+        return len(self._store.manifest()["decoders"])
 
-# App URLs for premium access
-PREMIUM_APP_URLS = {
-    "financial_advisor": "https://advisor-decoder-g33giprnbapgqxybkgxk5h.streamlit.app/",
-    "car_salesman": "https://car-salesman-decoder-tiye3psbwpspizha8kta8o.streamlit.app/",
-    "real_estate": "https://real-estate-agent-decoder-cqunc4r2zarq4rtqkej7bh.streamlit.app/",
-    "funeral_director": "https://funeral-home-decoder-p6bfaya2wqy4wgzoxrsa48.streamlit.app/"
+@st.cache_resource
+def get_content_store():
+    """Process-wide content store so each file is parsed once per process"""
+    return ContentStore(get_setting("CONTENT_DIR", DEFAULT_CONTENT_DIR))
+
+PDF_MIME_TYPE = "application/pdf"
+TEXT_MIME_TYPE = "text/plain"
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Form feed after every extracted PDF page, so trimming can tell where pages start and end
+PAGE_BREAK = "\f"
+
+# Label used in extraction error messages for each supported upload type
+DOCUMENT_TYPE_LABELS = {
+    PDF_MIME_TYPE: "PDF",
+    TEXT_MIME_TYPE: "text file",
+    DOCX_MIME_TYPE: "Word document"
 }
 
-def extract_text_from_file(uploaded_file):
+# Default caps so oversized uploads stop early instead of exhausting memory
+DEFAULT_EXTRACT_MAX_PAGES = 500
+DEFAULT_EXTRACT_MAX_CHARS = 2_000_000
+
+# One unit of extracted text: kind is "page", "paragraph" or "line", total is None when unknown
+DocumentChunk = namedtuple("DocumentChunk", ["kind", "number", "total", "text"])
+
+# Number of distinct uploads whose extracted text is kept per process
+EXTRACTION_CACHE_MAX_ENTRIES = 32
+
+# PDF/DOCX uploads at least this large are parsed in a process pool so they don't hold the GIL
+DEFAULT_EXTRACT_PROCESS_THRESHOLD_BYTES = 2 * 1024 * 1024
+DEFAULT_EXTRACT_TIMEOUT_SECONDS = 120
+
+def iter_document_chunks(file, file_type=None, max_pages=None):
+    """Yield DocumentChunk objects one page, paragraph or line at a time"""
+    file_type = file_type or file.type
+    
+    if file_type == PDF_MIME_TYPE:
+        import PyPDF2
+        pdf_reader = PyPDF2.PdfReader(file)
+        total_pages = len(pdf_reader.pages)
+        for index in range(min(total_pages, max_pages or total_pages)):
+            yield DocumentChunk("page", index + 1, total_pages, (pdf_reader.pages[index].extract_text() or "") + PAGE_BREAK)
+    
+    elif file_type == TEXT_MIME_TYPE:
+        file.seek(0)
+        for line_number, line in enumerate(file, start=1):
+            yield DocumentChunk("line", line_number, None, str(line, "utf-8"))
+    
+    elif file_type == DOCX_MIME_TYPE:
+        import docx
+        paragraphs = docx.Document(file).paragraphs
+        for index, paragraph in enumerate(paragraphs):
+            yield DocumentChunk("paragraph", index + 1, len(paragraphs), paragraph.text + "\n")
+    
+    else:
+        raise ValueError(f"Unsupported file type: {file_type}")
+
+def extraction_process_workers():
+    """Number of worker processes used for parsing large uploads"""
+    return int(get_setting("EXTRACT_PROCESS_WORKERS", min(4, os.cpu_count() or 1)))
+
+@st.cache_resource
+def get_extraction_process_pool():
+    """Process-wide pool for CPU-bound document parsing"""
+    # Forking the multithreaded server can leave a child stuck on a lock another thread held
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=extraction_process_workers(), mp_context=multiprocessing.get_context(start_method))
+
+def terminate_pool_workers(pool):
+    """Shut the pool down and kill its worker processes, including ones busy with a task
+    
+    ProcessPoolExecutor has no public way to reach its workers before Python 3.14, so this reads
+    the private _processes; tests/test_extraction.py pins that attribute.
+    """
+    # shutdown() drops the reference, so the workers are collected first
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+def recycle_extraction_process_pool(pool):
+    """Replace the pool and stop its workers, including any stuck on a parse that timed out
+    
+    future.cancel() cannot stop a parse that already started, so without this a few bad files
+    could keep every worker busy for good. Other uploads still using the old pool fail and are
+    retried on their next upload.
+    """
+    if get_extraction_process_pool() is pool:
+        get_extraction_process_pool.clear()
+    terminate_pool_workers(pool)
+
+@st.cache_resource
+def get_extraction_worker_slots():
+    """One slot per pool worker, shared by every upload being parsed"""
+    return threading.BoundedSemaphore(extraction_process_workers())
+
+def submit_to_worker(pool, fn, *args):
+    """Submit once a worker is free, returning the future and the time it started
+    
+    Waiting for a slot happens here, so time queued behind other uploads never counts
+    against the parse timeout.
+    """
+    slots = get_extraction_worker_slots()
+    slots.acquire()
+    try:
+        future = pool.submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future, time.monotonic()
+
+def worker_result(future, started_at, timeout):
+    return future.result(timeout=max(0, started_at + timeout - time.monotonic()))
+
+def iter_document_chunks_in_pool(data, file_type, max_pages=None, timeout=None):
+    """Like iter_document_chunks, but parses PDF pages or DOCX paragraphs in worker processes
+    
+    timeout applies to each batch of pages from the moment a worker is free to start on it.
+    """
+    import extraction_workers
+    
+    pool = get_extraction_process_pool()
+    timeout = timeout or DEFAULT_EXTRACT_TIMEOUT_SECONDS
+    futures = []
+    
+    try:
+        if file_type == PDF_MIME_TYPE:
+            import PyPDF2
+            
+            # Split the page range into one batch per worker
+            total_pages = len(PyPDF2.PdfReader(io.BytesIO(data)).pages)
+            page_limit = min(total_pages, max_pages or total_pages)
+            batch_size = max(1, math.ceil(page_limit / extraction_process_workers()))
+            for start in range(0, page_limit, batch_size):
+                futures.append(submit_to_worker(
+                    pool, extraction_workers.extract_pdf_pages, data, start, min(start + batch_size, page_limit)
+                ))
+            page_number = 0
+            for future, started_at in futures:
+                for page_text in worker_result(future, started_at, timeout):
+                    page_number += 1
+                    yield DocumentChunk("page", page_number, total_pages, page_text + PAGE_BREAK)
+        
+        elif file_type == DOCX_MIME_TYPE:
+            futures.append(submit_to_worker(pool, extraction_workers.extract_docx_paragraphs, data))
+            paragraphs = worker_result(*futures[0], timeout)
+            for index, paragraph_text in enumerate(paragraphs):
+                yield DocumentChunk("paragraph", index + 1, len(paragraphs), paragraph_text + "\n")
+        
+        else:
+            raise ValueError(f"Unsupported file type: {file_type}")
+    
+    except FuturesTimeoutError:
+        # The worker keeps parsing after a timeout, so it is stopped along with its pool
+        recycle_extraction_process_pool(pool)
+        raise TimeoutError(f"parsing took longer than {timeout} seconds")
+    except BrokenProcessPool:
+        # A crashed worker poisons the pool; start a fresh one for the next upload
+        recycle_extraction_process_pool(pool)
+        raise
+    finally:
+        # Stop batches that are no longer needed after a cap, timeout or error
+        for future, _ in futures:
+            future.cancel()
+
+@st.cache_data(max_entries=EXTRACTION_CACHE_MAX_ENTRIES, show_spinner=False)
+def extract_document_text(content_hash, file_type, _data, max_pages, max_chars):
+    """Extract text from raw upload bytes, memoized by content hash and file type
+    
+    Returns a dict with text, pages (PDF page count or None), characters, truncated and error.
+    Parsing errors are raised rather than returned so they are never memoized.
+    """
+    # Collect chunks in a list and join once to avoid quadratic string concatenation
+    parts = []
+    char_count = 0
+    page_count = None
+    truncated = False
+    
+    metrics = get_pipeline_metrics()
+    started = time.perf_counter()
+    
+    # Small uploads stay in-process to avoid pickling overhead
+    if file_type != TEXT_MIME_TYPE and len(_data) >= int(get_setting("EXTRACT_PROCESS_THRESHOLD_BYTES", DEFAULT_EXTRACT_PROCESS_THRESHOLD_BYTES)):
+        chunks = iter_document_chunks_in_pool(
+            _data, file_type, max_pages=max_pages,
+            timeout=int(get_setting("EXTRACT_TIMEOUT_SECONDS", DEFAULT_EXTRACT_TIMEOUT_SECONDS))
+        )
+    else:
+        chunks = iter_document_chunks(io.BytesIO(_data), file_type, max_pages=max_pages)
+    
+    try:
+        for chunk in chunks:
+            if chunk.kind == "page":
+                page_count = chunk.total
+                if chunk.total > max_pages:
+                    truncated = True
+            remaining = max_chars - char_count
+            if len(chunk.text) > remaining:
+                parts.append(chunk.text[:remaining])
+                char_count = max_chars
+                truncated = True
+                break
+            parts.append(chunk.text)
+            char_count += len(chunk.text)
+    except Exception as e:
+        metrics.increment("errors", stage="extract", error=type(e).__name__)
+        raise
+    finally:
+        chunks.close()
+        metrics.observe("extract", time.perf_counter() - started, file_type=DOCUMENT_TYPE_LABELS[file_type])
+    
+    metrics.increment("bytes_extracted", len(_data))
+    metrics.increment("characters_extracted", char_count)
+    if page_count:
+        metrics.increment("pages_extracted", min(page_count, max_pages))
+    
+    return {"text": "".join(parts), "pages": page_count, "characters": char_count,
+            "truncated": truncated, "error": None}
+
+def extract_document(content_hash, file_type, data, max_pages, max_chars):
+    """extract_document_text with failures reported in the result dict
+    
+    A timeout or crashed worker is therefore retried on the next upload instead of cached for this file.
+    """
+    if file_type not in DOCUMENT_TYPE_LABELS:
+        return {"text": None, "pages": None, "characters": 0, "truncated": False,
+                "error": "Unsupported file type. Please upload PDF, TXT, or DOCX files."}
+    try:
+        return extract_document_text(content_hash, file_type, data, max_pages, max_chars)
+    except Exception as e:
+        return {"text": None, "pages": None, "characters": 0, "truncated": False,
+                "error": f"Error reading {DOCUMENT_TYPE_LABELS[file_type]}: {str(e)}"}
+
+def read_uploaded_document(uploaded_file, max_pages=None, max_chars=None):
+    """Extraction result for an upload; re-uploads and reruns reuse the cached parse"""
+    max_pages = max_pages or int(get_setting("EXTRACT_MAX_PAGES", DEFAULT_EXTRACT_MAX_PAGES))
+    max_chars = max_chars or int(get_setting("EXTRACT_MAX_CHARS", DEFAULT_EXTRACT_MAX_CHARS))
+    data = uploaded_file.getvalue()
+    return extract_document(hashlib.sha256(data).hexdigest(), uploaded_file.type, data, max_pages, max_chars)
+
+def read_uploaded_documents(uploaded_files, max_pages=None, max_chars=None):
+    """(content_hash, extraction) per upload, parsed concurrently; duplicate uploads are parsed once"""
+    max_pages = max_pages or int(get_setting("EXTRACT_MAX_PAGES", DEFAULT_EXTRACT_MAX_PAGES))
+    max_chars = max_chars or int(get_setting("EXTRACT_MAX_CHARS", DEFAULT_EXTRACT_MAX_CHARS))
+    concurrency = int(get_setting("ANALYSIS_BATCH_CONCURRENCY", DEFAULT_ANALYSIS_BATCH_CONCURRENCY))
+    
+    keys = []
+    unique = {}
+    for uploaded_file in uploaded_files:
+        data = uploaded_file.getvalue()
+        key = (hashlib.sha256(data).hexdigest(), uploaded_file.type)
+        keys.append(key)
+        unique.setdefault(key, data)
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(unique)))) as executor:
+        futures = {
+            key: executor.submit(extract_document, key[0], key[1], data, max_pages, max_chars)
+            for key, data in unique.items()
+        }
+    
+    return [(key[0], futures[key].result()) for key in keys]
+
+def report_extraction_problems(extraction, max_pages=None, max_chars=None):
+    """Surface extraction errors and truncation to the user"""
+    if extraction["error"]:
+        st.error(extraction["error"])
+    elif extraction["truncated"]:
+        max_pages = max_pages or int(get_setting("EXTRACT_MAX_PAGES", DEFAULT_EXTRACT_MAX_PAGES))
+        max_chars = max_chars or int(get_setting("EXTRACT_MAX_CHARS", DEFAULT_EXTRACT_MAX_CHARS))
+        st.warning(f"Document is very large - only the first {max_pages} pages / {max_chars:,} characters were read.")
+
+def extract_text_from_file(uploaded_file, max_pages=None, max_chars=None):
     """Extract text from various file types"""
-    text = ""
+    extraction = read_uploaded_document(uploaded_file, max_pages, max_chars)
+    report_extraction_problems(extraction, max_pages, max_chars)
+    return extraction["text"]
+
+# Decoder-specific analysis prompts live in content/prompts.json; bump its version whenever the wording changes.
+# Its "models" section overrides these per decoder and for short documents.
+DEFAULT_MODEL_SETTINGS = {"model": "gpt-3.5-turbo", "max_tokens": 1000, "temperature": 0.3}
+ModelSettings = namedtuple("ModelSettings", ["backend", "model", "max_tokens", "temperature"])
+TokenUsage = namedtuple("TokenUsage", ["prompt_tokens", "completion_tokens"])
+
+# LLM_BACKEND selects who answers analysis prompts
+LLM_BACKENDS = ("openai", "openai_compatible", "mock")
+DEFAULT_LLM_BASE_URL = "http://localhost:8000/v1"
+TOKEN_ENCODING_MODEL = "gpt-3.5-turbo"
+
+# Documents above this budget are split into overlapping chunks and analyzed map-reduce style
+DEFAULT_ANALYSIS_CHUNK_TOKENS = 3000
+DEFAULT_ANALYSIS_CHUNK_OVERLAP_TOKENS = 200
+DEFAULT_ANALYSIS_CHUNK_CONCURRENCY = 4
+
+# Decoders analyzed in parallel when one upload is run through several decoders
+DEFAULT_ANALYSIS_DECODER_CONCURRENCY = 4
+
+# Background analysis jobs: worker threads per process and how long finished jobs are kept
+DEFAULT_ANALYSIS_JOB_WORKERS = 4
+DEFAULT_ANALYSIS_JOB_RETENTION_SECONDS = 3600
+ANALYSIS_JOB_POLL_SECONDS = 1
+
+# Per-user analysis history, so a document analyzed before is shown again instead of re-analyzed
+DEFAULT_ANALYSIS_HISTORY_RETENTION_DAYS = 90
+DEFAULT_ANALYSIS_HISTORY_MAX_ENTRIES = 1000
+ANALYSIS_HISTORY_PAGE_SIZE = 10
+HISTORY_OWNER_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+# Shared OpenAI rate limits; requests wait in priority order until both budgets allow them
+DEFAULT_OPENAI_REQUESTS_PER_MINUTE = 500
+DEFAULT_OPENAI_TOKENS_PER_MINUTE = 160000
+RETRY_BACKOFF_BASE_SECONDS = 1
+RETRY_BACKOFF_MAX_SECONDS = 30
+SCHEDULER_PRIORITY_INTERACTIVE = 0  # streamed to a user who is watching
+SCHEDULER_PRIORITY_MERGE = 1  # finishes a document whose sections are done
+SCHEDULER_PRIORITY_BACKGROUND = 2
+RATE_LIMIT_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+
+# Several uploads at once, e.g. three dealer quotes compared side by side
+DEFAULT_ANALYSIS_BATCH_MAX_FILES = 10
+DEFAULT_ANALYSIS_BATCH_CONCURRENCY = 3
+CHARS_PER_TOKEN = 4
+
+# Prompt preprocessing: default document token budget when prompts.json sets none for a decoder
+DEFAULT_ANALYSIS_TOKEN_BUDGET = 60000
+# Only the first and last lines of each page can be page numbers or running headers/footers
+PAGE_EDGE_LINES = 2
+PAGE_NUMBER_LINE = re.compile(r"^(page\s*)?(\d+)(\s*(of|/)\s*\d+)?$", re.IGNORECASE)
+PAGE_LABEL = re.compile(r"\bpage\s*\d+(\s*(of|/)\s*\d+)?\b", re.IGNORECASE)
+REPEATED_LINE_MIN_COUNT = 3
+REPEATED_LINE_MAX_CHARS = 120
+
+def resolve_decoder_type(decoder_type):
+    """Map unknown decoder types onto the default analysis prompt"""
+    return decoder_type if decoder_type in get_content_store().prompts()["decoders"] else "financial_advisor"
+
+def build_analysis_prompt(file_content, decoder_type):
+    """Fill the decoder-specific prompt template with the document text"""
+    with get_pipeline_metrics().timed("prompt_build"):
+        prompts = get_content_store().prompts()
+        return with_output_format(prompts["decoders"][resolve_decoder_type(decoder_type)].format(document=file_content))
+
+def with_output_format(prompt):
+    """Append the structured output instructions from prompts.json"""
+    output_format = get_content_store().prompts().get("output_format")
+    return f"{prompt}\n{output_format}" if output_format else prompt
+
+def normalize_document_text(text):
+    """Collapse whitespace so trivially different extractions share a cache entry"""
+    return " ".join(text.split())
+
+def analysis_model_settings(decoder_type, document_tokens=None):
+    """Backend, model, max_tokens and temperature for analyzing a document of this size"""
+    models = get_content_store().prompts().get("models", {})
+    settings = dict(DEFAULT_MODEL_SETTINGS)
+    settings.update(models.get("default", {}))
+    settings.update(models.get("decoders", {}).get(resolve_decoder_type(decoder_type), {}))
+    
+    # Short documents can go to a faster, cheaper model
+    short_documents = models.get("short_documents")
+    if short_documents and document_tokens is not None and document_tokens <= short_documents["max_document_tokens"]:
+        settings.update({field: value for field, value in short_documents.items() if field in MODEL_SETTING_TYPES})
+    
+    # Local servers usually serve one model under their own name
+    settings["model"] = get_setting("LLM_MODEL") or settings["model"]
+    return ModelSettings(get_llm_backend().name, settings["model"], settings["max_tokens"], float(settings["temperature"]))
+
+def analysis_cache_key(file_content, decoder_type, settings, prompt_kind="document"):
+    """Content-addressed key for an analysis result"""
+    digest = hashlib.sha256()
+    for part in (normalize_document_text(file_content), resolve_decoder_type(decoder_type),
+                 get_content_store().prompts()["version"], prompt_kind, settings.backend, settings.model,
+                 str(settings.max_tokens), repr(settings.temperature)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class MemoryAnalysisCache:
+    """In-process LRU cache of analysis results bounded by total result bytes"""
+    
+    name = "memory"
+    
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl_seconds=24 * 3600):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._size = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+    
+    def set(self, key, value):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (time.time() + self.ttl_seconds, size, value)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+    
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+def data_path(file_name):
+    """Default location of an on-disk store: DATA_DIR, or a directory in the app user's home"""
+    return os.path.join(get_setting("DATA_DIR") or os.path.join(os.path.expanduser("~"), ".decoder_universe"), file_name)
+
+def connect_private_sqlite(path):
+    """SQLite connection to a database only the app's user can read; raises OSError for a file owned by someone else"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    # Created here rather than by SQLite so it never exists with umask permissions; journals copy its mode
+    os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+    os.chmod(path, 0o600)
+    return sqlite3.connect(path, check_same_thread=False)
+
+class SQLiteAnalysisCache:
+    """On-disk analysis cache that survives restarts, with TTL and size-based eviction"""
+    
+    name = "sqlite"
+    
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, ttl_seconds=30 * 24 * 3600):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = connect_private_sqlite(path)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS analysis_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_accessed ON analysis_cache (accessed_at)")
+    
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM analysis_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            with self._conn:
+                if row[1] < now:
+                    self._conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                    return None
+                self._conn.execute("UPDATE analysis_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+    
+    def set(self, key, value):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + self.ttl_seconds, now)
+            )
+            self._evict(now)
+    
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM analysis_cache WHERE expires_at < ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM analysis_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM analysis_cache ORDER BY accessed_at"
+        ).fetchall():
+            self._conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+class TieredAnalysisCache:
+    """Checks each backend in order and backfills faster tiers on a hit"""
+    
+    def __init__(self, tiers):
+        self.tiers = tiers
+    
+    def get(self, key):
+        metrics = get_pipeline_metrics()
+        for i, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                metrics.increment("analysis_cache_hits", tier=tier.name)
+                for faster_tier in self.tiers[:i]:
+                    faster_tier.set(key, value)
+                return value
+        metrics.increment("analysis_cache_misses")
+        return None
     
-    if uploaded_file.type == "application/pdf":
+    def set(self, key, value):
+        for tier in self.tiers:
+            tier.set(key, value)
+
+@st.cache_resource
+def get_analysis_cache():
+    """Process-wide analysis cache shared by every session"""
+    tiers = [MemoryAnalysisCache(
+        max_bytes=int(get_setting("ANALYSIS_CACHE_MEMORY_MB", 16)) * 1024 * 1024,
+        ttl_seconds=int(get_setting("ANALYSIS_CACHE_TTL_SECONDS", 24 * 3600))
+    )]
+    
+    # An empty path disables the on-disk tier
+    cache_path = get_setting("ANALYSIS_CACHE_PATH", data_path("cache.sqlite3"))
+    if cache_path:
         try:
-            pdf_reader = PyPDF2.PdfReader(uploaded_file)
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-        except Exception as e:
-            st.error(f"Error reading PDF: {str(e)}")
+            tiers.append(SQLiteAnalysisCache(
+                cache_path,
+                max_bytes=int(get_setting("ANALYSIS_CACHE_DISK_MB", 256)) * 1024 * 1024,
+                ttl_seconds=int(get_setting("ANALYSIS_CACHE_DISK_TTL_SECONDS", 30 * 24 * 3600))
+            ))
+        except (sqlite3.Error, OSError):
+            pass
+    
+    return TieredAnalysisCache(tiers)
+
+class AnalysisResultStore:
+    """Structured analyses in SQLite JSON columns, one row per distinct analysis, with TTL and size-based eviction"""
+    
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, ttl_seconds=30 * 24 * 3600):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = connect_private_sqlite(path)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS analysis_results (
+                    cache_key TEXT PRIMARY KEY,
+                    document_hash TEXT NOT NULL,
+                    decoder_type TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    result TEXT NOT NULL CHECK (json_valid(result))
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_results_created ON analysis_results (created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_results_decoder ON analysis_results (decoder_type, created_at)")
+    
+    def has(self, cache_key):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM analysis_results WHERE cache_key = ? AND created_at >= ?", (cache_key, time.time() - self.ttl_seconds)
+            ).fetchone() is not None
+    
+    def save(self, cache_key, document_hash, decoder_type, model, analysis):
+        now = time.time()
+        result = json.dumps(analysis, separators=(",", ":"))
+        # The same analysis reached again through a cache hit or another session is stored once
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM analysis_results WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "INSERT OR IGNORE INTO analysis_results (cache_key, document_hash, decoder_type, model, created_at, size, result) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (cache_key, document_hash, decoder_type, model, now, len(result.encode("utf-8")), result)
+            )
+            self._evict()
+    
+    def get(self, cache_key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM analysis_results WHERE cache_key = ? AND created_at >= ?", (cache_key, time.time() - self.ttl_seconds)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def top_fees(self, limit=10):
+        """Fees found in the most documents, with their average dollar amount and average percentage"""
+        with self._lock:
+            return self._conn.execute("""
+                SELECT json_extract(fee.value, '$.item') AS item,
+                       COUNT(DISTINCT analysis_results.document_hash) AS documents,
+                       AVG(json_extract(fee.value, '$.amount')) AS average_amount,
+                       AVG(json_extract(fee.value, '$.percent')) AS average_percent
+                FROM analysis_results, json_each(analysis_results.result, '$.fees') AS fee
+                GROUP BY lower(item)
+                ORDER BY documents DESC, item
+                LIMIT ?
+            """, (limit,)).fetchall()
+    
+    def red_flag_counts(self):
+        """{severity: count} across every stored analysis"""
+        with self._lock:
+            return dict(self._conn.execute("""
+                SELECT json_extract(flag.value, '$.severity'), COUNT(*)
+                FROM analysis_results, json_each(analysis_results.result, '$.red_flags') AS flag
+                GROUP BY 1
+            """).fetchall())
+    
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM analysis_results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Oldest analyses go first
+        for cache_key, size in self._conn.execute(
+            "SELECT cache_key, size FROM analysis_results ORDER BY created_at"
+        ).fetchall():
+            self._conn.execute("DELETE FROM analysis_results WHERE cache_key = ?", (cache_key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+@st.cache_resource
+def get_analysis_result_store():
+    """Process-wide structured result store, or None when ANALYSIS_RESULTS_PATH is empty"""
+    path = get_setting("ANALYSIS_RESULTS_PATH", data_path("results.sqlite3"))
+    if not path:
+        return None
+    try:
+        return AnalysisResultStore(
+            path,
+            max_bytes=int(get_setting("ANALYSIS_RESULTS_MB", 64)) * 1024 * 1024,
+            ttl_seconds=int(get_setting("ANALYSIS_RESULTS_TTL_SECONDS", 30 * 24 * 3600))
+        )
+    except (sqlite3.Error, OSError):
+        return None
+
+class AnalysisHistory:
+    """Finished analyses per user in SQLite, newest first, evicted by age and per-user count"""
+    
+    # Listing columns come first so pages are read without touching the large result columns
+    LIST_COLUMNS = "id, created_at, file_name, document_hash, decoder_types, prompt_tokens, completion_tokens"
+    
+    def __init__(self, path, retention_seconds, max_entries):
+        self.retention_seconds = retention_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = connect_private_sqlite(path)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS analysis_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at REAL NOT NULL,
+                    file_name TEXT NOT NULL,
+                    document_hash TEXT NOT NULL,
+                    decoder_types TEXT NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    owner TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    analysis TEXT CHECK (analysis IS NULL OR json_valid(analysis))
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_history_owner ON analysis_history (owner, id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_history_document ON analysis_history (owner, document_hash)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_history_created ON analysis_history (created_at)")
+    
+    def add(self, owner, file_name, document_hash, decoder_types, result, analysis=None, usage=None):
+        now = time.time()
+        usage = usage or TokenUsage(0, 0)
+        with self._lock, self._conn:
+            entry_id = self._conn.execute(
+                "INSERT INTO analysis_history (created_at, file_name, document_hash, decoder_types, prompt_tokens, "
+                "completion_tokens, owner, result, analysis) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (now, file_name, document_hash, json.dumps(sorted(decoder_types)), usage.prompt_tokens,
+                 usage.completion_tokens, owner, result, json.dumps(analysis, separators=(",", ":")) if analysis else None)
+            ).lastrowid
+            self._evict(owner, now)
+        return entry_id
+    
+    def delete_owner(self, owner):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM analysis_history WHERE owner = ?", (owner,))
+    
+    def count(self, owner):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM analysis_history WHERE owner = ?", (owner,)).fetchone()[0]
+    
+    def page(self, owner, before_id=None, limit=ANALYSIS_HISTORY_PAGE_SIZE):
+        """Entries older than before_id, newest first; keyset pagination stays fast however long the history is"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self.LIST_COLUMNS} FROM analysis_history WHERE owner = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (owner, before_id if before_id is not None else 2 ** 63 - 1, limit)
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+    
+    def get(self, owner, entry_id):
+        """One entry with its result, or None if it belongs to someone else or was evicted"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self.LIST_COLUMNS}, result, analysis FROM analysis_history WHERE owner = ? AND id = ?",
+                (owner, entry_id)
+            ).fetchone()
+        return self._entry(row) if row else None
+    
+    def latest_for_document(self, owner, document_hash, decoder_types):
+        """The owner's most recent analysis of this document with these decoders"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self.LIST_COLUMNS} FROM analysis_history WHERE owner = ? AND document_hash = ? AND decoder_types = ? "
+                "ORDER BY id DESC LIMIT 1",
+                (owner, document_hash, json.dumps(sorted(decoder_types)))
+            ).fetchone()
+        return self._entry(row) if row else None
+    
+    def _entry(self, row):
+        entry = dict(row)
+        entry["decoder_types"] = json.loads(entry["decoder_types"])
+        if entry.get("analysis"):
+            entry["analysis"] = json.loads(entry["analysis"])
+        return entry
+    
+    def _evict(self, owner, now):
+        self._conn.execute("DELETE FROM analysis_history WHERE created_at < ?", (now - self.retention_seconds,))
+        # Heavy users keep their newest entries
+        self._conn.execute(
+            "DELETE FROM analysis_history WHERE owner = ? AND id <= ("
+            "SELECT id FROM analysis_history WHERE owner = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (owner, owner, self.max_entries)
+        )
+
+@st.cache_resource
+def get_analysis_history():
+    """Process-wide history store, or None when ANALYSIS_HISTORY_PATH is empty"""
+    path = get_setting("ANALYSIS_HISTORY_PATH", data_path("history.sqlite3"))
+    if not path:
+        return None
+    try:
+        return AnalysisHistory(
+            path,
+            retention_seconds=int(get_setting("ANALYSIS_HISTORY_RETENTION_DAYS", DEFAULT_ANALYSIS_HISTORY_RETENTION_DAYS)) * 24 * 3600,
+            max_entries=int(get_setting("ANALYSIS_HISTORY_MAX_ENTRIES", DEFAULT_ANALYSIS_HISTORY_MAX_ENTRIES))
+        )
+    except (sqlite3.Error, OSError):
+        return None
+
+def estimate_tokens(text):
+    """Rough token count for budgeting prompts"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+@st.cache_resource
+def get_token_encoding():
+    """tiktoken encoding for the analysis model, or None to fall back to estimate_tokens"""
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(TOKEN_ENCODING_MODEL)
+    except Exception:
+        # tiktoken is optional, and its first use may need to download encoding files
+        return None
+
+def count_tokens(text):
+    """Token count with tiktoken when installed, otherwise a character-based estimate"""
+    encoding = get_token_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text, max_tokens):
+    """The longest prefix of text that fits in max_tokens"""
+    encoding = get_token_encoding()
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+def trim_document_text(text):
+    """Normalize whitespace and drop page numbers and running headers/footers at page edges
+    
+    Pages are separated by PAGE_BREAK. Lines in the body of a page are never dropped, so amounts
+    on their own line and repeated contract clauses survive.
+    """
+    pages = [[" ".join(line.split()) for line in page.splitlines()] for page in text.split(PAGE_BREAK)]
+    
+    def edge_indexes(lines):
+        filled = [index for index, line in enumerate(lines) if line]
+        return set(filled[:PAGE_EDGE_LINES] + filled[-PAGE_EDGE_LINES:])
+    
+    def header_key(line):
+        # Exact repeats only, except that "Page 3" and "Page 4" count as the same footer
+        if len(line) > REPEATED_LINE_MAX_CHARS or sum(c.isalpha() for c in line) < 3:
             return None
-            
-    elif uploaded_file.type == "text/plain":
-        text = str(uploaded_file.read(), "utf-8")
+        return PAGE_LABEL.sub("page #", line)
+    
+    edges = [edge_indexes(lines) for lines in pages]
+    counts = Counter(header_key(lines[index]) for lines, indexes in zip(pages, edges) for index in indexes)
+    seen = set()
+    kept = []
+    for page_number, (lines, indexes) in enumerate(zip(pages, edges), start=1):
+        for index, line in enumerate(lines):
+            if not line:
+                if kept and kept[-1]:
+                    kept.append("")
+                continue
+            if index in indexes:
+                page_match = PAGE_NUMBER_LINE.match(line)
+                # A bare number is only a page number if it is this page's number
+                if page_match and (page_match.group(1) or page_match.group(3) or int(page_match.group(2)) == page_number):
+                    continue
+                key = header_key(line)
+                if key is not None and counts[key] >= REPEATED_LINE_MIN_COUNT:
+                    # Keep the first occurrence of a running header/footer only
+                    if key in seen:
+                        continue
+                    seen.add(key)
+            kept.append(line)
+        if kept and kept[-1]:
+            kept.append("")
+    
+    return "\n".join(kept).strip()
+
+def prepare_document_for_prompt(file_content, decoder_type):
+    """Trim the document and enforce the decoder's token budget, recording tokens saved"""
+    decoder_type = resolve_decoder_type(decoder_type)
+    budget = int(get_content_store().prompts().get("token_budgets", {}).get(
+        decoder_type, get_setting("ANALYSIS_TOKEN_BUDGET", DEFAULT_ANALYSIS_TOKEN_BUDGET)
+    ))
+    metrics = get_pipeline_metrics()
+    
+    with metrics.timed("prompt_trim"):
+        original_tokens = count_tokens(file_content)
+        trimmed = trim_document_text(file_content)
+        trimmed_tokens = count_tokens(trimmed)
+        if trimmed_tokens > budget:
+            trimmed = truncate_to_tokens(trimmed, budget) + f"\n\n[Document truncated to its first {budget:,} tokens]"
+            metrics.increment("documents_truncated", decoder=decoder_type)
+            trimmed_tokens = budget
+    
+    metrics.increment("prompt_tokens_saved", max(0, original_tokens - trimmed_tokens), decoder=decoder_type)
+    return trimmed, trimmed_tokens
+
+def split_text_into_chunks(text, max_tokens, overlap_tokens):
+    """Split text into overlapping chunks of roughly max_tokens, preferring paragraph and line breaks"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_chars = min(overlap_tokens * CHARS_PER_TOKEN, max_chars // 2)
+    chunks = []
+    start = 0
+    
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            for separator in ("\n\n", "\n", " "):
+                cut = text.rfind(separator, start + max_chars // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        chunks.append(text[start:end])
+        if end >= len(text):
+            break
+        start = max(end - overlap_chars, start + 1)
+    
+    return chunks
+
+def record_token_usage(usage, model):
+    """Add a completion's prompt and completion token counts to the metrics"""
+    if usage is None:
+        return
+    metrics = get_pipeline_metrics()
+    metrics.increment("prompt_tokens", usage.prompt_tokens, model=model)
+    metrics.increment("completion_tokens", usage.completion_tokens, model=model)
+    job_usage = analysis_token_usage.get()
+    if job_usage is not None:
+        job_usage.append(TokenUsage(usage.prompt_tokens, usage.completion_tokens))
+
+def total_token_usage(usages):
+    return TokenUsage(sum(usage.prompt_tokens for usage in usages), sum(usage.completion_tokens for usage in usages))
+
+# Job whose API requests are being made, so users can be shown their place in the scheduler queue
+analysis_owner = contextvars.ContextVar("analysis_owner", default=None)
+# Token usage of the running job, saved with its history entry; coalesced and cached analyses cost nothing
+analysis_token_usage = contextvars.ContextVar("analysis_token_usage", default=None)
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """executor.submit that carries the caller's analysis_owner and analysis_token_usage into the worker thread"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def parse_rate_limit_duration(value):
+    """Seconds in a rate-limit reset header such as "1s", "6m0s" or "20ms"; None if unparseable"""
+    if not value:
+        return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    parts = RATE_LIMIT_DURATION.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+class RateLimitScheduler:
+    """Process-wide gate that keeps API calls within requests- and tokens-per-minute budgets"""
+    
+    WINDOW_SECONDS = 60
+    
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._waiting = []  # heap of (priority, sequence, owner)
+        self._sequence = itertools.count()
+        self._sent = deque()  # (time, tokens) of requests sent within the window
+        self._sent_tokens = 0
+        self._blocked_until = 0.0
+        self._condition = threading.Condition()
+    
+    def acquire(self, tokens, priority=SCHEDULER_PRIORITY_BACKGROUND, owner=None, sequence=None):
+        """Block until this request may be sent; returns its sequence so a retry keeps its place"""
+        ticket = (priority, next(self._sequence) if sequence is None else sequence, owner)
+        started = time.perf_counter()
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    # Only the head of the queue may send; everyone else waits to be notified
+                    delay = self._delay(tokens) if self._waiting[0] is ticket else None
+                    if delay is not None and delay <= 0:
+                        break
+                    self._condition.wait(timeout=delay)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+            now = time.time()
+            self._sent.append((now, tokens))
+            self._sent_tokens += tokens
+        get_pipeline_metrics().observe("scheduler_wait", time.perf_counter() - started, priority=priority)
+        return ticket[1]
+    
+    def record_headers(self, headers, reply_tokens):
+        """Pause sending when the API reports an exhausted request or token budget"""
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        delays = []
+        if remaining_requests is not None and int(remaining_requests) <= 0:
+            delays.append(parse_rate_limit_duration(headers.get("x-ratelimit-reset-requests")))
+        # A completion needs room for its reply, so a nearly empty token budget counts as exhausted
+        if remaining_tokens is not None and int(remaining_tokens) < reply_tokens:
+            delays.append(parse_rate_limit_duration(headers.get("x-ratelimit-reset-tokens")))
+        delays = [delay for delay in delays if delay]
+        if delays:
+            self.pause(max(delays))
+    
+    def pause(self, seconds):
+        """Hold every queued request for at least this long, e.g. after a 429"""
+        with self._condition:
+            self._blocked_until = max(self._blocked_until, time.time() + seconds)
+            self._condition.notify_all()
+    
+    def queue_position(self, owner):
+        """1-based position of the owner's first waiting request, or None when it has none waiting"""
+        with self._condition:
+            for position, ticket in enumerate(sorted(self._waiting), start=1):
+                if ticket[2] == owner:
+                    return position
+        return None
+    
+    def _delay(self, tokens):
+        now = time.time()
+        while self._sent and self._sent[0][0] <= now - self.WINDOW_SECONDS:
+            self._sent_tokens -= self._sent.popleft()[1]
+        
+        delays = [self._blocked_until - now]
+        if len(self._sent) >= self.requests_per_minute:
+            delays.append(self._sent[0][0] + self.WINDOW_SECONDS - now)
+        # A request larger than the whole budget is sent alone once the window is empty
+        excess = self._sent_tokens + min(tokens, self.tokens_per_minute) - self.tokens_per_minute
+        for sent_at, sent_tokens in self._sent:
+            if excess <= 0:
+                break
+            excess -= sent_tokens
+            delays.append(sent_at + self.WINDOW_SECONDS - now)
+        return max(delays)
+
+@st.cache_resource
+def get_rate_limit_scheduler():
+    """Process-wide scheduler shared by every session and background worker"""
+    return RateLimitScheduler(
+        requests_per_minute=int(get_setting("OPENAI_REQUESTS_PER_MINUTE", DEFAULT_OPENAI_REQUESTS_PER_MINUTE)),
+        tokens_per_minute=int(get_setting("OPENAI_TOKENS_PER_MINUTE", DEFAULT_OPENAI_TOKENS_PER_MINUTE))
+    )
+
+def retry_delay(attempt, error):
+    """Jittered exponential backoff, never shorter than the server's Retry-After"""
+    delay = random.uniform(0, min(RETRY_BACKOFF_MAX_SECONDS, RETRY_BACKOFF_BASE_SECONDS * 2 ** attempt))
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = parse_rate_limit_duration(response.headers.get("retry-after"))
+        if retry_after:
+            delay = max(delay, retry_after)
+    return delay
+
+def scheduled_completion(send, prompt, settings, priority, scheduler=None):
+    """Run send() once the scheduler allows it, retrying rate limits and transient errors with backoff
+    
+    send must return a raw response (with_raw_response), whose rate-limit headers feed the scheduler.
+    Without a scheduler requests are sent straight away and only retried.
+    """
+    from openai import APIConnectionError, InternalServerError, RateLimitError
+    
+    metrics = get_pipeline_metrics()
+    # The API counts max_tokens against the token budget up front
+    tokens = count_tokens(prompt) + settings.max_tokens
+    max_retries = int(get_setting("OPENAI_MAX_RETRIES", 3))
+    sequence = None
+    
+    for attempt in range(max_retries + 1):
+        if scheduler is not None:
+            sequence = scheduler.acquire(tokens, priority, analysis_owner.get(), sequence)
+        try:
+            raw_response = send()
+        except (RateLimitError, APIConnectionError, InternalServerError) as e:
+            if attempt == max_retries:
+                raise
+            metrics.increment("api_retries", error=type(e).__name__)
+            delay = retry_delay(attempt, e)
+            if isinstance(e, RateLimitError) and scheduler is not None:
+                # The limit is per account, so every queued request waits
+                scheduler.pause(delay)
+            else:
+                time.sleep(delay)
+            continue
+        if scheduler is not None:
+            scheduler.record_headers(raw_response.headers, settings.max_tokens)
+        return raw_response.parse()
+
+@st.cache_resource
+def get_openai_client(base_url=None, api_key=None):
+    """Process-wide OpenAI client per endpoint so every session reuses warm pooled connections"""
+    import httpx
+    from openai import OpenAI
+    
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=int(get_setting("OPENAI_MAX_CONNECTIONS", 20)),
+            max_keepalive_connections=int(get_setting("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 10)),
+            keepalive_expiry=float(get_setting("OPENAI_KEEPALIVE_EXPIRY_SECONDS", 60))
+        ),
+        timeout=httpx.Timeout(
+            float(get_setting("OPENAI_TIMEOUT_SECONDS", 60)),
+            connect=float(get_setting("OPENAI_CONNECT_TIMEOUT_SECONDS", 10))
+        )
+    )
+    
+    # Retries are left to scheduled_completion so they respect the shared rate limits
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=http_client,
+        max_retries=0
+    )
+
+class OpenAIBackend:
+    """Chat completions over the OpenAI API or a server that speaks it, such as llama.cpp or vLLM"""
+    
+    def __init__(self, name, client, scheduler=None, stream_usage=True):
+        self.name = name
+        self.client = client
+        self.scheduler = scheduler
+        self.stream_usage = stream_usage
+    
+    def complete(self, prompt, settings, priority):
+        metrics = get_pipeline_metrics()
+        
+        def send():
+            # Timed per attempt, so time spent queued in the scheduler is not counted
+            with metrics.timed("completion", model=settings.model):
+                return self.client.chat.completions.with_raw_response.create(
+                    model=settings.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=settings.max_tokens,
+                    temperature=settings.temperature
+                )
+        
+        response = scheduled_completion(send, prompt, settings, priority, self.scheduler)
+        record_token_usage(response.usage, settings.model)
+        return response.choices[0].message.content
+    
+    def stream(self, prompt, settings, priority):
+        metrics = get_pipeline_metrics()
+        started = None
+        first_token_seen = False
+        # Not every compatible server accepts stream_options
+        extra = {"stream_options": {"include_usage": True}} if self.stream_usage else {}
         
-    elif uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+        def send():
+            # Timed from the attempt that opens the stream, so time spent queued in the scheduler
+            # is only counted in scheduler_wait, as for complete()
+            nonlocal started
+            started = time.perf_counter()
+            return self.client.chat.completions.with_raw_response.create(
+                model=settings.model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=settings.max_tokens,
+                temperature=settings.temperature,
+                stream=True,
+                **extra
+            )
+        
+        # Only opening the stream is retried; errors after the first delta reach the caller
+        response = scheduled_completion(send, prompt, settings, priority, self.scheduler)
+        
+        for event in response:
+            # The final event carries token usage and no choices
+            if getattr(event, "usage", None) is not None:
+                record_token_usage(event.usage, settings.model)
+            if event.choices and event.choices[0].delta.content:
+                if not first_token_seen:
+                    first_token_seen = True
+                    metrics.observe("time_to_first_token", time.perf_counter() - started, model=settings.model)
+                yield event.choices[0].delta.content
+        
+        metrics.observe("completion", time.perf_counter() - started, model=settings.model)
+
+class MockBackend:
+    """Deterministic offline stand-in: the same prompt always gets the same reply"""
+    
+    name = "mock"
+    
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+    
+    def reply(self, prompt, settings):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+        amounts = list(dict.fromkeys(re.findall(r"\$\s?\d[\d,]*(?:\.\d{2})?", prompt)))[:5]
+        items = [{"type": "summary", "text": f"Mock analysis {digest} of {count_tokens(prompt):,} prompt tokens."}]
+        items += [{"type": "fee", "item": "Charge found in the document", "amount": amount, "quote": amount} for amount in amounts]
+        items += [
+            {"type": "red_flag", "description": "No real analysis was run", "severity": "low", "quote": ""},
+            {"type": "recommendation", "text": "Configure a real LLM backend for a full analysis"}
+        ]
+        return truncate_to_tokens("\n".join(json.dumps(item) for item in items), settings.max_tokens)
+    
+    def complete(self, prompt, settings, priority):
+        with get_pipeline_metrics().timed("completion", model=settings.model):
+            time.sleep(self.latency_seconds)
+            text = self.reply(prompt, settings)
+        record_token_usage(TokenUsage(count_tokens(prompt), count_tokens(text)), settings.model)
+        return text
+    
+    def stream(self, prompt, settings, priority):
+        time.sleep(self.latency_seconds)
+        text = self.reply(prompt, settings)
+        record_token_usage(TokenUsage(count_tokens(prompt), count_tokens(text)), settings.model)
+        for word in re.findall(r"\S+\s*", text):
+            yield word
+
+@st.cache_resource
+def get_llm_backend():
+    """Process-wide backend chosen by LLM_BACKEND"""
+    backend = get_setting("LLM_BACKEND", "openai")
+    if backend == "openai":
+        return OpenAIBackend(
+            "openai",
+            get_openai_client(get_setting("OPENAI_BASE_URL"), get_setting("OPENAI_API_KEY")),
+            scheduler=get_rate_limit_scheduler()
+        )
+    if backend == "openai_compatible":
+        # Local servers have no shared account limits, so requests are not scheduled
+        return OpenAIBackend(
+            "openai_compatible",
+            get_openai_client(get_setting("LLM_BASE_URL", DEFAULT_LLM_BASE_URL), get_setting("LLM_API_KEY", "not-needed")),
+            stream_usage=False
+        )
+    if backend == "mock":
+        return MockBackend(float(get_setting("LLM_MOCK_LATENCY_MS", 0)) / 1000)
+    raise ValueError(f"Unknown LLM_BACKEND '{backend}'; expected one of {', '.join(LLM_BACKENDS)}")
+
+def request_analysis_completion(prompt, settings, priority=SCHEDULER_PRIORITY_BACKGROUND):
+    """Send one prompt to the configured backend and return the response text"""
+    return get_llm_backend().complete(prompt, settings, priority)
+
+def stream_analysis_completion(prompt, settings):
+    """Send one prompt to the configured backend and yield text deltas as they arrive"""
+    return get_llm_backend().stream(prompt, settings, SCHEDULER_PRIORITY_INTERACTIVE)
+
+def cached_analysis_completion(cache, cache_key, prompt, settings, priority=SCHEDULER_PRIORITY_BACKGROUND):
+    """Return the cached result for cache_key, calling the API on a miss"""
+    result = cache.get(cache_key)
+    if result is None:
+        result = request_analysis_completion(prompt, settings, priority)
+        # Only successful analyses are cached so errors are retried next time
+        if result:
+            cache.set(cache_key, result)
+    return result
+
+def reduce_partial_analyses(partials, decoder_type, cache, max_tokens, settings):
+    """Merge partial analyses, in several rounds if they do not fit one prompt"""
+    while len(partials) > 1:
+        groups = [[]]
+        for partial in partials:
+            if groups[-1] and estimate_tokens("".join(groups[-1]) + partial) > max_tokens:
+                groups.append([])
+            groups[-1].append(partial)
+        
+        # Nothing can be combined further without overflowing the prompt budget
+        if len(groups) == len(partials) and len(partials) > 1:
+            groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+        
+        reduced = []
+        for group in groups:
+            if len(group) == 1:
+                reduced.append(group[0])
+                continue
+            joined = "\n\n".join(f"--- Section {i} of {len(group)} ---\n{partial}" for i, partial in enumerate(group, start=1))
+            reduced.append(cached_analysis_completion(
+                cache,
+                analysis_cache_key(joined, decoder_type, settings, prompt_kind="reduce"),
+                with_output_format(get_content_store().prompts()["reduce"].format(partials=joined)),
+                settings,
+                SCHEDULER_PRIORITY_MERGE
+            ))
+        partials = reduced
+    
+    return partials[0]
+
+def analyze_document_in_chunks(file_content, decoder_type, cache, chunk_tokens, settings):
+    """Map-reduce analysis: analyze overlapping chunks concurrently, then merge the reports"""
+    cache_key = analysis_cache_key(file_content, decoder_type, settings, prompt_kind="chunked")
+    analysis_result = cache.get(cache_key)
+    if analysis_result is not None:
+        return analysis_result
+    
+    overlap_tokens = int(get_setting("ANALYSIS_CHUNK_OVERLAP_TOKENS", DEFAULT_ANALYSIS_CHUNK_OVERLAP_TOKENS))
+    concurrency = int(get_setting("ANALYSIS_CHUNK_CONCURRENCY", DEFAULT_ANALYSIS_CHUNK_CONCURRENCY))
+    chunks = split_text_into_chunks(file_content, chunk_tokens, overlap_tokens)
+    
+    # Each chunk is cached on its own, so a retry after a partial failure only redoes missing chunks
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(chunks)))) as executor:
+        futures = [
+            submit_in_context(
+                executor,
+                cached_analysis_completion,
+                cache,
+                analysis_cache_key(chunk, decoder_type, settings),
+                build_analysis_prompt(chunk, decoder_type),
+                settings
+            )
+            for chunk in chunks
+        ]
+    
+    partials = []
+    failures = []
+    for future in futures:
         try:
-            doc = docx.Document(uploaded_file)
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
+            partials.append(future.result())
         except Exception as e:
-            st.error(f"Error reading Word document: {str(e)}")
-            return None
-            
-    else:
-        st.error("Unsupported file type. Please upload PDF, TXT, or DOCX files.")
+            failures.append(e)
+    
+    if failures:
+        raise RuntimeError(
+            f"{len(failures)} of {len(chunks)} document sections could not be analyzed ({failures[0]}). "
+            "Completed sections are saved, so analyzing again only retries the missing ones"
+        )
+    
+    analysis_result = reduce_partial_analyses(partials, decoder_type, cache, chunk_tokens, settings)
+    if analysis_result:
+        cache.set(cache_key, analysis_result)
+    return analysis_result
+
+def analysis_error_message(error):
+    """User-facing text for a failed analysis"""
+    get_pipeline_metrics().increment("errors", stage="analysis", error=type(error).__name__)
+    if type(error).__name__ == "RateLimitError":
+        return "The AI service is at capacity right now and retries did not get through. Please try again in a few minutes."
+    return f"Error analyzing document: {str(error)}. Please check your OpenAI API key configuration."
+
+# Analyses come back as one JSON object per line (see output_format in prompts.json)
+ANALYSIS_ITEM_LISTS = {"fee": "fees", "conflict": "conflicts", "red_flag": "red_flags", "recommendation": "recommendations"}
+ANALYSIS_SECTIONS = (
+    ("fees", "HIDDEN FEES"),
+    ("conflicts", "CONFLICTS OF INTEREST"),
+    ("red_flags", "RED FLAGS"),
+    ("recommendations", "RECOMMENDATIONS")
+)
+
+def parse_number(value, unit):
+    """Float from a number or text like '$1,295.00' or '1.5%'; text with a different unit gives None"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        match = re.search(r"\d[\d,]*(?:\.\d+)?", value)
+        # "1%" is not a dollar amount and "$50" is not a percentage
+        if match and (("%" in value) == (unit == "%")):
+            return float(match.group().replace(",", ""))
+    return None
+
+def validate_analysis_item(item):
+    """Normalized analysis item, or None if it does not follow the output format"""
+    if not isinstance(item, dict):
         return None
+    fields = {field: " ".join(value.split()) for field, value in item.items() if isinstance(value, str)}
+    kind = item.get("type")
+    
+    if kind in ("summary", "recommendation") and fields.get("text"):
+        return {"type": kind, "text": fields["text"]}
+    if kind == "fee" and fields.get("item"):
+        amount = item.get("amount")
+        # Models sometimes put a rate like "1%" in the amount field
+        percent = parse_number(item.get("percent"), "%")
+        if percent is None:
+            percent = parse_number(amount, "%") if isinstance(amount, str) else None
+        return {
+            "type": kind,
+            "item": fields["item"],
+            "amount": parse_number(amount, "$"),
+            "percent": percent,
+            "quote": fields.get("quote", "")
+        }
+    if kind == "conflict" and fields.get("description"):
+        return {"type": kind, "description": fields["description"], "quote": fields.get("quote", "")}
+    if kind == "red_flag" and fields.get("description"):
+        severity = fields.get("severity", "").lower()
+        return {
+            "type": kind,
+            "description": fields["description"],
+            "severity": severity if severity in SCAN_SEVERITIES else "medium",
+            "quote": fields.get("quote", "")
+        }
+    return None
+
+def quote_search_text(text):
+    """Lowercase words only, so quotes match despite spacing and punctuation differences"""
+    return " " + " ".join(re.findall(r"[\w$%]+", text.lower())) + " "
+
+def parse_structured_analysis(text, document=None, complete=True):
+    """Analysis dict from the model's JSON lines
+    
+    Lines that are not JSON, such as error messages, are kept as notes. With the document,
+    every quote is marked verified or not so invented citations can be flagged.
+    complete=False skips the last line, which may still be streaming.
+    """
+    analysis = {"summary": "", "fees": [], "conflicts": [], "red_flags": [], "recommendations": [], "notes": [], "invalid_items": 0}
+    lines = text.split("\n")
+    if not complete:
+        lines = lines[:-1]
+    searchable = quote_search_text(document) if document is not None else None
+    
+    for line in lines:
+        line = line.strip().rstrip(",")
+        if not line or line in ("[", "]") or line.startswith("```"):
+            continue
+        try:
+            item = validate_analysis_item(json.loads(line))
+        except ValueError:
+            analysis["notes"].append(line)
+            continue
+        if item is None:
+            analysis["invalid_items"] += 1
+            continue
+        
+        kind = item.pop("type")
+        if kind == "summary":
+            analysis["summary"] = analysis["summary"] or item["text"]
+            continue
+        if searchable is not None and item.get("quote"):
+            item["verified"] = quote_search_text(item["quote"]) in searchable
+        analysis[ANALYSIS_ITEM_LISTS[kind]].append(item)
+    
+    return analysis
+
+def analysis_item_markdown(field, item):
+    if field == "fees":
+        text = f"**{item['item']}**"
+        values = []
+        if item["amount"] is not None:
+            values.append(f"${item['amount']:,.2f}".replace(".00", ""))
+        if item.get("percent") is not None:
+            values.append(f"{item['percent']:g}%")
+        if values:
+            text += ": " + ", ".join(values)
+    elif field == "red_flags":
+        text = f"{SEVERITY_ICONS[item['severity']]} {item['description']}"
+    elif field == "recommendations":
+        return item["text"]
+    else:
+        text = item["description"]
     
+    if item.get("quote"):
+        text += f" — “{item['quote']}”"
+        if item.get("verified") is False:
+            text += " *(not found in the document)*"
     return text
 
-def analyze_document_with_ai(file_content, decoder_type):
-    """Analyze document using OpenAI based on decoder type"""
+def render_structured_analysis(analysis):
+    """Markdown report for an analysis dict, with dollar signs escaped for st.markdown"""
+    blocks = []
+    if analysis["summary"]:
+        blocks.append(f"**SUMMARY**\n\n{analysis['summary']}")
+    for field, heading in ANALYSIS_SECTIONS:
+        items = analysis[field]
+        if field == "red_flags":
+            items = sorted(items, key=lambda item: SCAN_SEVERITIES.index(item["severity"]))
+        if items:
+            blocks.append(f"**{heading}**\n" + "\n".join(f"- {analysis_item_markdown(field, item)}" for item in items))
+    if analysis["notes"]:
+        blocks.append("\n".join(analysis["notes"]))
+    # Dollar amounts would otherwise be rendered as LaTeX
+    return "\n\n".join(blocks).replace("$", "\\$")
+
+def has_findings(analysis):
+    """Whether the model returned any findings, as opposed to only an error message"""
+    return any(analysis[field] for field, _ in ANALYSIS_SECTIONS)
+
+def save_analysis_result(cache_key, file_content, decoder_type, settings, raw_result):
+    """Store a finished analysis in structured form, once per cache key"""
+    store = get_analysis_result_store()
+    if store is None:
+        return
+    try:
+        if store.has(cache_key):
+            return
+        analysis = parse_structured_analysis(raw_result, file_content)
+        if analysis["invalid_items"]:
+            get_pipeline_metrics().increment("analysis_invalid_items", analysis["invalid_items"])
+        if has_findings(analysis):
+            document_hash = hashlib.sha256(normalize_document_text(file_content).encode("utf-8")).hexdigest()
+            store.save(cache_key, document_hash, resolve_decoder_type(decoder_type), settings.model, analysis)
+    except sqlite3.Error as e:
+        get_pipeline_metrics().increment("errors", stage="result_store", error=type(e).__name__)
+
+class AnalysisStream:
+    """Iterable of analysis text deltas that also assembles the final text and records time to first token"""
+    
+    def __init__(self, deltas):
+        self._deltas = deltas
+        self._parts = []
+        self.started_at = time.perf_counter()
+        self.time_to_first_token = None
+        self.elapsed = None
+    
+    def __iter__(self):
+        for delta in self._deltas:
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.perf_counter() - self.started_at
+            self._parts.append(delta)
+            yield delta
+        self.elapsed = time.perf_counter() - self.started_at
+    
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+class SharedDeltas:
+    """Deltas of one in-flight analysis, replayed to every session that joined it"""
+    
+    def __init__(self):
+        self._parts = []
+        self._done = False
+        self._error = None
+        self._condition = threading.Condition()
+    
+    def publish(self, delta):
+        with self._condition:
+            self._parts.append(delta)
+            self._condition.notify_all()
+    
+    def finish(self, error=None):
+        with self._condition:
+            self._done = True
+            self._error = error
+            self._condition.notify_all()
+    
+    def follow(self):
+        """Yield every delta from the beginning, waiting for new ones until the analysis finishes"""
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self._parts) and not self._done:
+                    self._condition.wait()
+                parts = self._parts[index:]
+                done, error = self._done, self._error
+            index += len(parts)
+            yield from parts
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+class InFlightAnalyses:
+    """Single-flight registry: identical concurrent analyses attach to the first one instead of calling the API again"""
+    
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+    
+    def join(self, key, start):
+        """Deltas for key, produced by start() unless an identical analysis is already running"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = SharedDeltas()
+        
+        if leader:
+            return self._lead(key, flight, start)
+        get_pipeline_metrics().increment("analyses_coalesced")
+        return flight.follow()
+    
+    def _lead(self, key, flight, start):
+        try:
+            for delta in start():
+                flight.publish(delta)
+                yield delta
+            flight.finish()
+        except BaseException as e:
+            # Includes GeneratorExit when the leading session stops reading early
+            flight.finish(e if isinstance(e, Exception) else RuntimeError("The shared analysis was cancelled"))
+            raise
+        finally:
+            # Later requests for the same document are served by the analysis cache
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+@st.cache_resource
+def get_in_flight_analyses():
+    """Process-wide single-flight registry shared by every session and background worker"""
+    return InFlightAnalyses()
+
+def stream_document_analysis(file_content, decoder_type, chunked, chunk_tokens, settings):
+    """Yield analysis text deltas, streaming from the API unless the result is already cached"""
+    cache = get_analysis_cache()
+    parts = []
     
     try:
-        # Initialize OpenAI client
-        client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+        # Chunked analysis only has a result after the reduce step, so it arrives in one piece
+        if chunked:
+            analysis_result = analyze_document_in_chunks(file_content, decoder_type, cache, chunk_tokens, settings)
+            save_analysis_result(analysis_cache_key(file_content, decoder_type, settings, prompt_kind="chunked"),
+                                 file_content, decoder_type, settings, analysis_result)
+            yield analysis_result
+            return
         
-        # Create decoder-specific prompts
-        prompts = {
-            "financial_advisor": f"""
-            Analyze this financial document for hidden fees, conflicts of interest, and predatory tactics.
-            
-            Document: {file_content}
-            
-            Provide analysis in this format:
-            1. FEES IDENTIFIED: List specific fees with percentages/amounts
-            2. CONFLICT INDICATORS: Note any compensation conflicts
-            3. RED FLAGS: Identify manipulative language or high-pressure tactics
-            4. RECOMMENDATIONS: Suggest protective actions
-            
-            Focus on: advisor compensation, hidden fees, revenue sharing, proprietary products.
-            """,
-            
-            "real_estate": f"""
-            Analyze this real estate document for predatory practices and hidden costs.
-            
-            Document: {file_content}
-            
-            Provide analysis in this format:
-            1. COSTS IDENTIFIED: All fees, commissions, and charges
-            2. AGENCY CONFLICTS: Dual agency or representation issues  
-            3. RED FLAGS: Pressure tactics or misleading information
-            4. RECOMMENDATIONS: Protective steps to take
-            
-            Focus on: agent commissions, dual agency, inflated prices, rushed decisions.
-            """,
-            
-            "car_salesman": f"""
-            Analyze this automotive document for dealership tricks and hidden costs.
-            
-            Document: {file_content}
-            
-            Provide analysis in this format:
-            1. COSTS IDENTIFIED: All fees, financing terms, and add-ons
-            2. FINANCING TRICKS: Interest rate markups or payment manipulation
-            3. RED FLAGS: Bait-and-switch or pressure tactics
-            4. RECOMMENDATIONS: Negotiation strategies
-            
-            Focus on: dealer markup, financing scams, unnecessary add-ons, pressure tactics.
-            """,
-            
-            "funeral_director": f"""
-            Analyze this funeral service document for unnecessary costs and emotional manipulation.
-            
-            Document: {file_content}
-            
-            Provide analysis in this format:
-            1. COSTS IDENTIFIED: All service fees and merchandise charges
-            2. UNNECESSARY SERVICES: Optional items presented as required
-            3. RED FLAGS: Emotional manipulation or legal misrepresentations
-            4. RECOMMENDATIONS: Ways to reduce costs legally
+        cache_key = analysis_cache_key(file_content, decoder_type, settings)
+        cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            save_analysis_result(cache_key, file_content, decoder_type, settings, cached_result)
+            yield cached_result
+            return
+        
+        for delta in stream_analysis_completion(build_analysis_prompt(file_content, decoder_type), settings):
+            parts.append(delta)
+            yield delta
+        
+    except Exception as e:
+        yield ("\n\n" if parts else "") + analysis_error_message(e)
+        return
+    
+    # Only complete streams are cached
+    analysis_result = "".join(parts)
+    if analysis_result:
+        cache.set(cache_key, analysis_result)
+        save_analysis_result(cache_key, file_content, decoder_type, settings, analysis_result)
+
+def analyze_document_with_ai(file_content, decoder_type, chunked=None, stream=False, structured=False):
+    """Analyze document with the configured LLM backend based on decoder type
+    
+    chunked=None picks map-reduce analysis automatically for documents over the chunk token budget.
+    stream=True returns an AnalysisStream of raw JSON-lines deltas instead of the finished report.
+    structured=True returns the validated analysis dict instead of markdown.
+    """
+    # Whitespace, page numbers and repeated headers/footers cost tokens without adding meaning
+    file_content, document_tokens = prepare_document_for_prompt(file_content, decoder_type)
+    
+    chunk_tokens = int(get_setting("ANALYSIS_CHUNK_TOKENS", DEFAULT_ANALYSIS_CHUNK_TOKENS))
+    if chunked is None:
+        chunked = document_tokens > chunk_tokens
+    settings = analysis_model_settings(decoder_type, document_tokens)
+    
+    # Sessions analyzing the same document at the same time share one API call
+    flight_key = analysis_cache_key(file_content, decoder_type, settings, prompt_kind="chunked" if chunked else "document")
+    in_flight = get_in_flight_analyses()
+    
+    if not stream:
+        # Stored analyses re-render without touching the cache or the API
+        store = get_analysis_result_store()
+        stored_analysis = store.get(flight_key) if store is not None else None
+        if stored_analysis is not None:
+            return stored_analysis if structured else render_structured_analysis(stored_analysis)
+    
+    if stream:
+        return AnalysisStream(in_flight.join(
+            flight_key, lambda: stream_document_analysis(file_content, decoder_type, chunked, chunk_tokens, settings)
+        ))
+    
+    def analyze():
+        # Identical documents return the stored analysis without another API call
+        cache = get_analysis_cache()
+        
+        try:
+            if chunked:
+                analysis_result = analyze_document_in_chunks(file_content, decoder_type, cache, chunk_tokens, settings)
+            else:
+                analysis_result = cached_analysis_completion(cache, flight_key, build_analysis_prompt(file_content, decoder_type), settings)
             
-            Focus on: required vs optional services, emotional manipulation, overpricing, legal requirements.
-            """
+        except Exception as e:
+            return analysis_error_message(e)
+        
+        save_analysis_result(flight_key, file_content, decoder_type, settings, analysis_result)
+        return analysis_result
+    
+    analysis = parse_structured_analysis("".join(in_flight.join(flight_key, lambda: [analyze()])), file_content)
+    return analysis if structured else render_structured_analysis(analysis)
+
+def analyze_document_with_decoders(file_content, decoder_types, structured=False):
+    """Run several decoder analyses of one document concurrently, returning {decoder_type: result}"""
+    concurrency = int(get_setting("ANALYSIS_DECODER_CONCURRENCY", DEFAULT_ANALYSIS_DECODER_CONCURRENCY))
+    
+    # Wall-clock time is close to the slowest single analysis rather than the sum
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(decoder_types)))) as executor:
+        futures = {
+            decoder_type: submit_in_context(executor, analyze_document_with_ai, file_content, decoder_type, structured=structured)
+            for decoder_type in decoder_types
         }
+    
+    return {decoder_type: future.result() for decoder_type, future in futures.items()}
+
+def build_combined_report(results):
+    """Join per-decoder analyses into one markdown report"""
+    return "\n\n".join(
+        f"## {DECODERS[decoder_type]['icon']} {DECODERS[decoder_type]['name']}\n\n{result}"
+        for decoder_type, result in results.items()
+    )
+
+def analyze_document_structured(file_content, decoder_types):
+    """Validated analyses of one document with one or several decoders, {decoder_type: analysis}"""
+    if len(decoder_types) > 1:
+        return analyze_document_with_decoders(file_content, decoder_types, structured=True)
+    return {decoder_types[0]: analyze_document_with_ai(file_content, decoder_types[0], structured=True)}
+
+def render_decoder_analyses(analyses):
+    """Markdown report for {decoder_type: analysis}, with a section per decoder when there are several"""
+    if len(analyses) > 1:
+        return build_combined_report({
+            decoder_type: render_structured_analysis(analysis) for decoder_type, analysis in analyses.items()
+        })
+    return render_structured_analysis(next(iter(analyses.values())))
+
+def build_batch_report(documents):
+    """One markdown report comparing several analyzed documents"""
+    lines = [
+        "# Document Comparison",
+        "",
+        "| Document | Pages | Characters | Instant-scan red flags |",
+        "|---|---|---|---|"
+    ]
+    for document in documents:
+        pages = document["pages"] if document["pages"] is not None else "-"
+        name = document["file_name"].replace("|", "\\|")
+        lines.append(f"| {name} | {pages} | {document['characters']:,} | {document['red_flags']} |")
+    
+    for document in documents:
+        lines += ["", f"## 📄 {document['file_name']}", ""]
+        if document["duplicate_of"]:
+            lines += [f"*Identical to {document['duplicate_of']} - analyzed once.*", ""]
+        lines.append(document["result"] or "")
+    return "\n".join(lines)
+
+def build_batch_zip(documents, report):
+    """ZIP archive with the comparison report and one report per document"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("comparison_report.md", report)
+        for number, document in enumerate(documents, start=1):
+            stem = re.sub(r"[^\w.-]+", "_", os.path.splitext(document["file_name"])[0])
+            archive.writestr(f"{number:02d}_{stem}.md", f"# {document['file_name']}\n\n{document['result'] or ''}")
+    return buffer.getvalue()
+
+# Local red-flag scanning runs on every upload before any AI call
+SCAN_MAX_FINDINGS = 200
+SCAN_CONTEXT_CHARS = 60
+SCAN_CACHE_MAX_ENTRIES = 64
+DEFAULT_PRESCAN_SHORT_DOCUMENT_CHARS = 3000
+
+def derive_quoted_phrase_rules(decoder):
+    """Scanner rules for phrases quoted in a decoder's tactics and red flags, e.g. 'This offer expires today!'"""
+    rules = []
+    for field in ("preview_tactics", "premium_tactics", "preview_flags", "premium_flags"):
+        for item in decoder[field]:
+            for phrase in re.findall(r"'([^']{8,80})'", item):
+                words = re.findall(r"[A-Za-z0-9$%]+", phrase)
+                if len(words) < 2:
+                    continue
+                # Tolerate any punctuation or spacing between the quoted words
+                rules.append({
+                    "pattern": r"\b" + r"\W+".join(re.escape(word) for word in words) + r"\b",
+                    "label": item if len(item) <= 90 else item[:87] + "...",
+                    "severity": "high" if field.endswith("flags") else "medium"
+                })
+    return rules
+
+@st.cache_resource
+def compile_red_flag_scanner(decoder_key, content_version):
+    """One case-insensitive alternation regex per decoder and content version, plus its rules"""
+    decoder = DECODERS[decoder_key]
+    rules = decoder.get("scan_patterns", []) + derive_quoted_phrase_rules(decoder)
+    pattern = re.compile(
+        "|".join(f"(?P<r{index}>{rule['pattern']})" for index, rule in enumerate(rules)),
+        re.IGNORECASE
+    )
+    return pattern, rules
+
+def scan_document_for_red_flags(text, decoder_types):
+    """Findings with character offsets, ordered by position in the document"""
+    findings = []
+    with get_pipeline_metrics().timed("prescan"):
+        for decoder_type in decoder_types:
+            pattern, rules = compile_red_flag_scanner(decoder_type, get_content_store().decoder_version(decoder_type))
+            if not rules:
+                continue
+            for match in pattern.finditer(text):
+                rule = rules[int(match.lastgroup[1:])]
+                findings.append({
+                    "decoder_type": decoder_type,
+                    "start": match.start(),
+                    "end": match.end(),
+                    "match": match.group(),
+                    "label": rule["label"],
+                    "severity": rule["severity"]
+                })
+                if len(findings) >= SCAN_MAX_FINDINGS:
+                    break
+    
+    findings.sort(key=lambda finding: finding["start"])
+    return findings[:SCAN_MAX_FINDINGS]
+
+@st.cache_data(max_entries=SCAN_CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_red_flag_findings(content_hash, decoder_types, decoder_versions, _text):
+    """scan_document_for_red_flags memoized per upload, decoder selection and decoder content version"""
+    return scan_document_for_red_flags(_text, list(decoder_types))
+
+def scan_upload_for_red_flags(content_hash, text, decoder_types):
+    """Findings for an upload, scanned once rather than on every rerun and job poll"""
+    versions = tuple(get_content_store().decoder_version(decoder_type) for decoder_type in decoder_types)
+    return cached_red_flag_findings(content_hash, tuple(decoder_types), versions, text)
+
+def finding_snippet(text, finding):
+    """The matched text in bold with some surrounding context"""
+    before = text[max(0, finding["start"] - SCAN_CONTEXT_CHARS):finding["start"]]
+    after = text[finding["end"]:finding["end"] + SCAN_CONTEXT_CHARS]
+    snippet = " ".join(f"…{before}**{finding['match']}**{after}…".split())
+    # Dollar amounts would otherwise be rendered as LaTeX by st.markdown
+    return snippet.replace("$", "\\$")
+
+def build_prescan_report(text, findings):
+    """Markdown report made only from local scan findings, used when the AI call is skipped"""
+    lines = [
+        "**RED FLAGS (instant local scan)**",
+        "",
+        "*This quick scan matches known warning phrases only. Run a full AI analysis for fees, conflicts and recommendations.*",
+        ""
+    ]
+    for finding in findings:
+        lines.append(
+            f"- {SEVERITY_ICONS[finding['severity']]} **{finding['label']}** "
+            f"(characters {finding['start']:,}-{finding['end']:,}): {finding_snippet(text, finding)}"
+        )
+    return "\n".join(lines)
+
+def show_prescan_findings(text, findings):
+    """Summarize local scan findings right after upload"""
+    if not findings:
+        st.write("**⚡ Instant scan:** no known warning phrases found")
+        return
+    
+    high = sum(1 for finding in findings if finding["severity"] == "high")
+    st.write(f"**⚡ Instant scan:** {len(findings)} potential red flags ({high} high severity)")
+    with st.expander("Show instant scan matches"):
+        st.markdown(build_prescan_report(text, findings))
+
+class AnalysisJob:
+    """One queued document analysis and its outcome"""
+    
+    def __init__(self, file_name, decoder_types, history_owner=None, document_hash=None):
+        self.id = uuid.uuid4().hex
+        self.file_name = file_name
+        self.decoder_types = decoder_types
+        self.history_owner = history_owner
+        self.document_hash = document_hash
+        self.status = "queued"
+        self.result = None
+        self.analysis = None
+        self.token_usage = None
+        self.error = None
+        self.stream = None
+        self.documents = []
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+    
+    @property
+    def is_active(self):
+        return self.status in ("queued", "running")
+    
+    @property
+    def partial_text(self):
+        """Markdown for the complete lines streamed so far while the job is running"""
+        if self.stream is None:
+            return ""
+        return render_structured_analysis(parse_structured_analysis(self.stream.text, complete=False))
+
+class AnalysisJobQueue:
+    """Bounded worker pool that runs analyses outside Streamlit reruns"""
+    
+    def __init__(self, max_workers, retention_seconds):
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # Held while jobs write to a history, so a history being deleted gets no new entries
+        self._history_lock = threading.Lock()
+    
+    def submit(self, file_content, file_name, decoder_types, history_owner=None, document_hash=None):
+        """Queue one document; with a history owner the finished analysis is added to their history"""
+        job = AnalysisJob(file_name, decoder_types, history_owner, document_hash)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, file_content)
+        return job.id
+    
+    def submit_batch(self, documents, texts, decoder_types, history_owner=None):
+        """Queue several documents as one job; texts maps content hash to extracted text"""
+        job = AnalysisJob(f"{len(documents)} documents", decoder_types, history_owner)
+        job.documents = documents
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run_batch, job, texts)
+        return job.id
+    
+    def add_finished(self, file_name, decoder_types, result, history_owner=None, document_hash=None, analysis=None, token_usage=None):
+        """Store an already-computed result so it renders and persists like any other job"""
+        job = AnalysisJob(file_name, decoder_types, history_owner, document_hash)
+        job.result = result
+        job.analysis = analysis
+        job.token_usage = token_usage
+        job.started_at = time.time()
+        self._finish(job, "done")
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._record_history(job, file_name, document_hash, result, analysis)
+        return job.id
+    
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def forget_history_owner(self, history, owner):
+        """Delete an owner's history, including entries that queued and running jobs would still add"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        with self._history_lock:
+            for job in jobs:
+                if job.history_owner == owner:
+                    job.history_owner = None
+            history.delete_owner(owner)
+    
+    def queue_position(self, job):
+        """1-based position among jobs still waiting for a worker"""
+        with self._lock:
+            return 1 + sum(
+                1 for other in self._jobs.values()
+                if other.status == "queued" and other.submitted_at < job.submitted_at
+            )
+    
+    def _run(self, job, file_content):
+        analysis_owner.set(job.id)
+        usages = []
+        analysis_token_usage.set(usages)
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            if len(job.decoder_types) > 1:
+                analyses = analyze_document_with_decoders(file_content, job.decoder_types, structured=True)
+                job.result = render_decoder_analyses(analyses)
+            else:
+                job.stream = analyze_document_with_ai(file_content, job.decoder_types[0], stream=True)
+                for _ in job.stream:
+                    pass
+                job.analysis = parse_structured_analysis(job.stream.text, file_content)
+                job.result = render_structured_analysis(job.analysis)
+                analyses = {job.decoder_types[0]: job.analysis}
+            job.token_usage = total_token_usage(usages)
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, "failed")
+            return
+        self._record_analyses(job, job.file_name, job.document_hash, analyses, job.token_usage)
+        self._finish(job, "done")
+    
+    def _run_batch(self, job, texts):
+        analysis_owner.set(job.id)
+        job.status = "running"
+        job.started_at = time.time()
+        concurrency = int(get_setting("ANALYSIS_BATCH_CONCURRENCY", DEFAULT_ANALYSIS_BATCH_CONCURRENCY))
+        
+        def set_status(content_hash, status, result=None):
+            for document in job.documents:
+                if document["content_hash"] == content_hash:
+                    document["status"] = status
+                    document["result"] = result
         
-        prompt = prompts.get(decoder_type, prompts["financial_advisor"])
+        def analyze(content_hash):
+            set_status(content_hash, "running")
+            # Each document runs in its own copied context, so its tokens are counted separately
+            usages = []
+            analysis_token_usage.set(usages)
+            return analyze_document_structured(texts[content_hash], job.decoder_types), total_token_usage(usages)
         
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=1000,
-            temperature=0.3
+        try:
+            # Duplicate uploads share a content hash and are analyzed once
+            usages = []
+            with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(texts)))) as executor:
+                futures = {submit_in_context(executor, analyze, content_hash): content_hash for content_hash in texts}
+                for future in as_completed(futures):
+                    content_hash = futures[future]
+                    try:
+                        analyses, usage = future.result()
+                    except Exception as e:
+                        set_status(content_hash, "failed", analysis_error_message(e))
+                        continue
+                    usages.append(usage)
+                    result = render_decoder_analyses(analyses)
+                    if not any(has_findings(analysis) for analysis in analyses.values()):
+                        # Every decoder ended in an error message
+                        set_status(content_hash, "failed", result)
+                        continue
+                    set_status(content_hash, "done", result)
+                    file_name = next(document["file_name"] for document in job.documents if document["content_hash"] == content_hash)
+                    self._record_analyses(job, file_name, content_hash, analyses, usage)
+            job.token_usage = total_token_usage(usages)
+            job.result = build_batch_report(job.documents)
+        except Exception as e:
+            job.error = str(e)
+            self._finish(job, "failed")
+            return
+        self._finish(job, "done")
+    
+    def _finish(self, job, status):
+        # Pages render finished jobs as soon as they stop being active, so everything else is set first
+        job.finished_at = time.time()
+        job.status = status
+    
+    def _record_analyses(self, job, file_name, document_hash, analyses, usage):
+        """Add the decoders that produced findings to the history; failed analyses end in an error message instead"""
+        analyses = {decoder_type: analysis for decoder_type, analysis in analyses.items() if has_findings(analysis)}
+        if not analyses:
+            return
+        analysis = next(iter(analyses.values())) if len(analyses) == 1 else None
+        self._record_history(job, file_name, document_hash, render_decoder_analyses(analyses), analysis, usage, list(analyses))
+    
+    def _record_history(self, job, file_name, document_hash, result, analysis=None, usage=None, decoder_types=None):
+        history = get_analysis_history() if job.history_owner else None
+        if history is None:
+            return
+        try:
+            with self._history_lock:
+                if job.history_owner is None:
+                    # Forgotten while the job ran
+                    return
+                history.add(job.history_owner, file_name, document_hash or "", decoder_types or job.decoder_types, result, analysis,
+                            usage if usage is not None else job.token_usage)
+        except sqlite3.Error as e:
+            get_pipeline_metrics().increment("errors", stage="history", error=type(e).__name__)
+    
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+@st.cache_resource
+def get_analysis_job_queue():
+    """Process-wide job queue, so running analyses survive reruns and navigation"""
+    return AnalysisJobQueue(
+        max_workers=int(get_setting("ANALYSIS_JOB_WORKERS", DEFAULT_ANALYSIS_JOB_WORKERS)),
+        retention_seconds=int(get_setting("ANALYSIS_JOB_RETENTION_SECONDS", DEFAULT_ANALYSIS_JOB_RETENTION_SECONDS))
+    )
+
+def show_analysis_job(job_state_key):
+    """Render the session's analysis job, polling with reruns until it finishes"""
+    job_queue = get_analysis_job_queue()
+    job = job_queue.get(st.session_state[job_state_key])
+    
+    if job is None:
+        # Expired or lost in a server restart
+        del st.session_state[job_state_key]
+        st.info("Your previous analysis is no longer available. Please analyze the document again.")
+        return
+    
+    st.markdown("### 📊 Analysis Results")
+    st.caption(f"📄 {job.file_name}")
+    
+    if job.documents:
+        show_batch_analysis_job(job_queue, job)
+        return
+    
+    if job.status == "queued":
+        st.info(f"⏳ Waiting for an analysis slot - you are number {job_queue.queue_position(job)} in line")
+    elif job.status == "running":
+        api_position = get_rate_limit_scheduler().queue_position(job.id)
+        if job.partial_text:
+            st.markdown(job.partial_text + "▌")
+        elif api_position:
+            st.info(f"⏳ The AI service is busy - your request is number {api_position} in line")
+        else:
+            st.info("🤖 AI is analyzing your document...")
+    elif job.status == "failed":
+        st.error(f"Error analyzing document: {job.error}")
+        return
+    
+    if job.is_active:
+        # The job keeps running in the background while the page polls for progress
+        time.sleep(ANALYSIS_JOB_POLL_SECONDS)
+        st.rerun()
+    
+    st.markdown(job.result)
+    if job.stream is not None and job.stream.time_to_first_token is not None:
+        st.caption(f"⚡ First results in {job.stream.time_to_first_token:.1f}s · complete in {job.stream.elapsed:.1f}s")
+    if job.token_usage is not None:
+        st.caption(f"🪙 {format_token_usage(job.token_usage)}")
+    
+    # Add download option
+    analyzed_at = datetime.fromtimestamp(job.finished_at)
+    report = job.result.replace("\\$", "$")
+    st.download_button(
+        label="📥 Download Analysis Report",
+        data=f"Document Analysis Report\n\nFile: {job.file_name}\nAnalyzed: {analyzed_at.strftime('%Y-%m-%d %H:%M:%S')}\n\n{report}",
+        file_name=f"decoder_analysis_{analyzed_at.strftime('%Y%m%d_%H%M')}.txt",
+        mime="text/plain",
+        key=f"download_{job.id}"
+    )
+    if job.analysis is not None:
+        st.download_button(
+            label="🧾 Download Analysis Data (JSON)",
+            data=json.dumps({"file": job.file_name, "analyzed_at": analyzed_at.isoformat(), "analysis": job.analysis}, indent=2),
+            file_name=f"decoder_analysis_{analyzed_at.strftime('%Y%m%d_%H%M')}.json",
+            mime="application/json",
+            key=f"download_json_{job.id}"
+        )
+
+def show_batch_analysis_job(job_queue, job):
+    """Per-document progress for a batch job, then the analyses side by side"""
+    if job.status == "queued":
+        st.info(f"⏳ Waiting for an analysis slot - you are number {job_queue.queue_position(job)} in line")
+    elif job.status == "failed":
+        st.error(f"Error analyzing documents: {job.error}")
+        return
+    
+    finished = sum(1 for document in job.documents if document["status"] in ("done", "failed"))
+    st.progress(finished / len(job.documents), text=f"{finished} of {len(job.documents)} documents analyzed")
+    
+    if job.is_active:
+        api_position = get_rate_limit_scheduler().queue_position(job.id)
+        if api_position:
+            st.info(f"⏳ The AI service is busy - your next request is number {api_position} in line")
+        status_icons = {"queued": "⏳", "running": "🤖", "done": "✅", "failed": "❌"}
+        for document in job.documents:
+            st.write(f"{status_icons[document['status']]} {document['file_name']}")
+        time.sleep(ANALYSIS_JOB_POLL_SECONDS)
+        st.rerun()
+    
+    # At most three documents per row so each column stays readable
+    for row_start in range(0, len(job.documents), 3):
+        row = job.documents[row_start:row_start + 3]
+        for column, document in zip(st.columns(len(row)), row):
+            with column:
+                st.markdown(f"#### 📄 {document['file_name']}")
+                if document["duplicate_of"]:
+                    st.caption(f"Identical to {document['duplicate_of']}")
+                st.markdown(document["result"] or "")
+    
+    analyzed_at = datetime.fromtimestamp(job.finished_at)
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="📥 Download Comparison Report",
+            data=job.result,
+            file_name=f"decoder_comparison_{analyzed_at.strftime('%Y%m%d_%H%M')}.md",
+            mime="text/markdown",
+            key=f"download_{job.id}"
         )
+    with col2:
+        st.download_button(
+            label="🗜️ Download All Reports (ZIP)",
+            data=build_batch_zip(job.documents, job.result),
+            file_name=f"decoder_analyses_{analyzed_at.strftime('%Y%m%d_%H%M')}.zip",
+            mime="application/zip",
+            key=f"download_zip_{job.id}"
+        )
+
+def get_history_owner():
+    """Anonymous id for this user's history, or None until they opt in to saving it
+    
+    The id is kept in the page URL so the history survives reloads; opening a saved link brings it back.
+    """
+    owner = st.session_state.get("history_owner")
+    if owner is None:
+        linked_owner = st.query_params.get("history", "")
+        if not HISTORY_OWNER_PATTERN.fullmatch(linked_owner):
+            return None
+        owner = st.session_state.history_owner = linked_owner
+    if st.query_params.get("history") != owner:
+        st.query_params["history"] = owner
+    return owner
+
+def forget_history(history, owner):
+    """Delete the user's history and take its id out of the page URL"""
+    get_analysis_job_queue().forget_history_owner(history, owner)
+    st.session_state.pop("history_owner", None)
+    st.session_state.pop("history_cursors", None)
+    if "history" in st.query_params:
+        del st.query_params["history"]
+
+def format_token_usage(usage):
+    tokens = usage.prompt_tokens + usage.completion_tokens
+    return f"{tokens:,} AI tokens" if tokens else "no AI tokens used"
+
+def open_history_entry(entry, job_state_key):
+    """Show a saved analysis as the current result, without another API call"""
+    analyzed_at = datetime.fromtimestamp(entry["created_at"]).strftime("%Y-%m-%d %H:%M")
+    st.session_state[job_state_key] = get_analysis_job_queue().add_finished(
+        f"{entry['file_name']} (saved analysis from {analyzed_at})",
+        entry["decoder_types"],
+        entry["result"],
+        analysis=entry.get("analysis")
+    )
+    get_pipeline_metrics().increment("history_reopened")
+
+def show_saved_analysis_offer(document_hash, decoder_types, job_state_key):
+    """Point out that this document was already analyzed with these decoders"""
+    history = get_analysis_history()
+    owner = get_history_owner()
+    if history is None or owner is None:
+        return
+    entry = history.latest_for_document(owner, document_hash, decoder_types)
+    if entry is None:
+        return
+    analyzed_at = datetime.fromtimestamp(entry["created_at"]).strftime("%Y-%m-%d %H:%M")
+    st.info(f"📂 You analyzed this document on {analyzed_at}.")
+    if st.button("📂 Show Saved Analysis", disabled=analysis_job_active(job_state_key), key=f"saved_{job_state_key}"):
+        entry = history.get(owner, entry["id"])
+        if entry is not None:
+            open_history_entry(entry, job_state_key)
+
+def show_analysis_history(job_state_key):
+    """The user's past analyses, newest first, one page at a time"""
+    history = get_analysis_history()
+    if history is None:
+        return
+    owner = get_history_owner()
+    if owner is None:
+        # Off by default: the history link shows file names and results to anyone who has it
+        with st.expander("🕘 Save Your Analysis History"):
+            st.write("Keep your analyses so you can reopen them later without analyzing the document again. "
+                     f"Entries are deleted after {get_setting('ANALYSIS_HISTORY_RETENTION_DAYS', DEFAULT_ANALYSIS_HISTORY_RETENTION_DAYS)} days.")
+            st.warning("Your history is tied to this page's link. Anyone you share the link with can see your "
+                       "file names and analyses - bookmark it, but don't send it to anyone.")
+            if st.button("💾 Save My History", key="history_opt_in"):
+                st.session_state.history_owner = uuid.uuid4().hex
+                st.rerun()
+        return
+    total = history.count(owner)
+    
+    # Stack of keyset cursors: the id each page starts below, None for the newest page
+    cursors = st.session_state.setdefault("history_cursors", [None])
+    entries = history.page(owner, cursors[-1])
+    if not entries and len(cursors) > 1:
+        # The page was evicted since it was opened
+        cursors[:] = [None]
+        entries = history.page(owner)
+    first = (len(cursors) - 1) * ANALYSIS_HISTORY_PAGE_SIZE + 1
+    
+    with st.expander(f"🕘 Your Analysis History ({total})"):
+        st.caption("Bookmark this page to come back to your history later. Don't share the link - it shows your history to anyone who opens it.")
+        if not entries:
+            st.write("Analyses you run from now on will appear here.")
+        for entry in entries:
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                analyzed_at = datetime.fromtimestamp(entry["created_at"]).strftime("%Y-%m-%d %H:%M")
+                icons = "".join(DECODERS[decoder_type]["icon"] for decoder_type in entry["decoder_types"] if decoder_type in DECODERS)
+                usage = TokenUsage(entry["prompt_tokens"], entry["completion_tokens"])
+                st.write(f"**{entry['file_name']}** {icons} · {analyzed_at} · {format_token_usage(usage)}")
+            with col2:
+                if st.button("Open", key=f"history_open_{entry['id']}", use_container_width=True):
+                    entry = history.get(owner, entry["id"])
+                    if entry is None:
+                        st.warning("This analysis is no longer in your history.")
+                    else:
+                        open_history_entry(entry, job_state_key)
+                        st.rerun()
         
-        return response.choices[0].message.content
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            if st.button("← Newer", disabled=len(cursors) == 1, key="history_newer"):
+                cursors.pop()
+                st.rerun()
+        with col2:
+            st.caption(f"{first}-{first + len(entries) - 1} of {total}")
+        with col3:
+            if st.button("Older →", disabled=first + len(entries) > total, key="history_older"):
+                cursors.append(entries[-1]["id"])
+                st.rerun()
         
-    except Exception as e:
-        return f"Error analyzing document: {str(e)}. Please check your OpenAI API key configuration."
+        if st.button("🗑️ Delete My History", key="history_delete"):
+            forget_history(history, owner)
+            st.rerun()
+
+def analysis_job_active(job_state_key):
+    """Whether the session's analysis job is still queued or running"""
+    return job_state_key in st.session_state and getattr(
+        get_analysis_job_queue().get(st.session_state[job_state_key]), "is_active", False
+    )
+
+def select_decoder_types(decoder_key):
+    """Decoders to apply to an upload, defaulting to the current decoder"""
+    # Documents often span categories, e.g. a car contract with financing terms
+    return st.multiselect(
+        "Decoders to apply",
+        options=list(get_content_store().prompts()["decoders"]),
+        default=[resolve_decoder_type(decoder_key)],
+        format_func=lambda key: f"{DECODERS[key]['icon']} {DECODERS[key]['name']}",
+        help="Add decoders for documents that cover several areas - they are analyzed in parallel",
+        key=f"doc_decoders_{decoder_key}"
+    ) or [resolve_decoder_type(decoder_key)]
+
+def show_batch_upload(decoder_key, uploaded_files, job_state_key):
+    """Read several uploads and queue them as one comparison job"""
+    st.success(f"✅ {len(uploaded_files)} documents uploaded successfully!")
+    
+    with st.spinner("📄 Reading your documents..."):
+        extractions = read_uploaded_documents(uploaded_files)
+    
+    decoder_types = select_decoder_types(decoder_key)
+    
+    documents = []
+    texts = {}
+    first_names = {}
+    for uploaded_file, (content_hash, extraction) in zip(uploaded_files, extractions):
+        duplicate_of = first_names.get(content_hash)
+        first_names.setdefault(content_hash, uploaded_file.name)
+        
+        details = [f"{uploaded_file.size / 1024:.1f} KB"]
+        if extraction["pages"] is not None:
+            details.append(f"{extraction['pages']} pages")
+        details.append(f"{extraction['characters']:,} characters")
+        if duplicate_of:
+            details.append(f"identical to {duplicate_of}")
+        st.write(f"**{uploaded_file.name}** · " + " · ".join(details))
+        report_extraction_problems(extraction)
+        if not extraction["text"]:
+            continue
+        
+        documents.append({
+            "file_name": uploaded_file.name,
+            "content_hash": content_hash,
+            "pages": extraction["pages"],
+            "characters": extraction["characters"],
+            "red_flags": len(scan_upload_for_red_flags(content_hash, extraction["text"], decoder_types)),
+            "duplicate_of": duplicate_of,
+            "status": "queued",
+            "result": None
+        })
+        texts[content_hash] = extraction["text"]
+    
+    if st.button(f"🔍 Analyze {len(documents)} Documents", disabled=analysis_job_active(job_state_key) or not documents):
+        # Analysis runs in the background so widget reruns don't abort or repeat it
+        st.session_state[job_state_key] = get_analysis_job_queue().submit_batch(
+            documents, texts, decoder_types, history_owner=get_history_owner()
+        )
 
 def show_document_analysis(decoder_key):
     """Show document analysis feature for founding members"""
     st.markdown("### 📄 AI-Powered Document Analysis")
     st.markdown("*Upload contracts, agreements, or proposals for intelligent analysis*")
     
-    uploaded_file = st.file_uploader(
-        "Choose a document to analyze",
+    job_state_key = f"analysis_job_{decoder_key}"
+    
+    uploaded_files = st.file_uploader(
+        "Choose documents to analyze",
         type=['pdf', 'docx', 'txt'],
-        help="Upload financial documents, contracts, or proposals for AI analysis",
+        accept_multiple_files=True,
+        help="Upload financial documents, contracts, or proposals for AI analysis - add several to compare them side by side",
         key=f"doc_upload_{decoder_key}"
-    )
+    ) or []
+    
+    max_files = int(get_setting("ANALYSIS_BATCH_MAX_FILES", DEFAULT_ANALYSIS_BATCH_MAX_FILES))
+    if len(uploaded_files) > max_files:
+        st.warning(f"Only the first {max_files} documents will be analyzed.")
+        uploaded_files = uploaded_files[:max_files]
+    uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
     
-    if uploaded_file is not None:
+    if len(uploaded_files) > 1:
+        show_batch_upload(decoder_key, uploaded_files, job_state_key)
+    elif uploaded_file is not None:
         st.success("✅ Document uploaded successfully!")
         
         col1, col2 = st.columns([2, 1])
         with col1:
             st.write(f"**File:** {uploaded_file.name}")
             st.write(f"**Size:** {uploaded_file.size / 1024:.1f} KB")
+            
+            # Text is extracted once per distinct upload and reused by every rerun and re-analysis
+            with st.spinner("📄 Reading your document..."):
+                extraction = read_uploaded_document(uploaded_file)
+            document_hash = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+            if extraction["text"] is not None:
+                page_info = f"{extraction['pages']} pages · " if extraction["pages"] is not None else ""
+                st.write(f"**Extracted:** {page_info}{extraction['characters']:,} characters")
+            report_extraction_problems(extraction)
+            
+            decoder_types = select_decoder_types(decoder_key)
+            
+            # Known warning phrases are highlighted instantly, before any AI call
+            findings = []
+            if extraction["text"]:
+                findings = scan_upload_for_red_flags(document_hash, extraction["text"], decoder_types)
+                show_prescan_findings(extraction["text"], findings)
+            
+            short_document_chars = int(get_setting("PRESCAN_SHORT_DOCUMENT_CHARS", DEFAULT_PRESCAN_SHORT_DOCUMENT_CHARS))
+            instant_scan_only = False
+            if findings and extraction["characters"] <= short_document_chars:
+                instant_scan_only = st.checkbox(
+                    "⚡ Instant scan report only (no AI call)",
+                    help="For short documents the instant scan may be all you need - it returns immediately and uses no AI tokens",
+                    key=f"instant_scan_only_{decoder_key}"
+                )
         
         with col2:
-            if st.button("🔍 Analyze Document", use_container_width=True):
-                with st.spinner("🤖 AI is analyzing your document..."):
-                    # Extract text
-                    extracted_text = extract_text_from_file(uploaded_file)
-                    
-                    if extracted_text:
-                        # Analyze with AI
-                        analysis_result = analyze_document_with_ai(extracted_text, decoder_key)
-                        
-                        # Display results
-                        st.markdown("### 📊 Analysis Results")
-                        st.markdown(analysis_result)
-                        
-                        # Add download option
-                        st.download_button(
-                            label="📥 Download Analysis Report",
-                            data=f"Document Analysis Report\n\nFile: {uploaded_file.name}\nAnalyzed: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n{analysis_result}",
-                            file_name=f"decoder_analysis_{datetime.now().strftime('%Y%m%d_%H%M')}.txt",
-                            mime="text/plain"
-                        )
-                    else:
-                        st.error("Could not extract text from document. Please try a different file.")
+            # Re-uploading a contract shows its saved analysis instead of paying for it again
+            if extraction["text"]:
+                show_saved_analysis_offer(document_hash, decoder_types, job_state_key)
+            if st.button("🔍 Analyze Document", use_container_width=True, disabled=analysis_job_active(job_state_key)):
+                if instant_scan_only:
+                    st.session_state[job_state_key] = get_analysis_job_queue().add_finished(
+                        uploaded_file.name, decoder_types, build_prescan_report(extraction["text"], findings),
+                        history_owner=get_history_owner(), document_hash=document_hash, token_usage=TokenUsage(0, 0)
+                    )
+                elif extraction["text"]:
+                    # Analysis runs in the background so widget reruns don't abort or repeat it
+                    st.session_state[job_state_key] = get_analysis_job_queue().submit(
+                        extraction["text"], uploaded_file.name, decoder_types,
+                        history_owner=get_history_owner(), document_hash=document_hash
+                    )
+                else:
+                    st.error("Could not extract text from document. Please try a different file.")
+    
+    # Results stay available after reruns and navigation until a new analysis is started
+    if job_state_key in st.session_state:
+        show_analysis_job(job_state_key)
+    
+    show_analysis_history(job_state_key)
 
 def show_premium_app_access(decoder_key):
     """Show premium app access for founding members"""
@@ -338,269 +2755,33 @@ def show_premium_app_access(decoder_key):
                 st.success(f"Opening your complete {decoder['name']} app in a new tab!")
                 st.markdown(f"**If it didn't open automatically, [click here]({app_url})**")
 
+@st.cache_data(show_spinner=False)
+def build_legal_page_fragments(name, content_version):
+    """Pre-compiled (title, [(tab label, markdown)]) for a legal page, rebuilt only when its file changes"""
+    page = get_content_store().legal_page(name)
+    if "tabs" not in page:
+        # Single-section pages are sent as one markdown element
+        return f"{page['title']}\n\n{page['body']}", []
+    return page["title"], [(section["label"], section["body"]) for section in page["tabs"]]
+
+def show_legal_page(name):
+    """Render a legal page from the content store, with one tab per section when it has tabs"""
+    title, sections = build_legal_page_fragments(name, get_content_store().legal_page_version(name))
+    st.markdown(title)
+    
+    if sections:
+        for tab, (_, body) in zip(st.tabs([label for label, _ in sections]), sections):
+            with tab:
+                st.markdown(body)
+
 def show_legal_disclaimers():
     """Show comprehensive legal disclaimers and terms"""
     st.markdown("---")
-    st.markdown("### ⚖️ Legal Disclaimers & Terms of Use")
-    
-    disclaimer_tabs = st.tabs(["📋 General Disclaimer", "🏦 Financial", "🏠 Real Estate", "🚗 Automotive", "⚱️ Funeral", "🔒 Privacy & Data"])
-    
-    with disclaimer_tabs[0]:
-        st.markdown("""
-        **EDUCATIONAL PURPOSES ONLY**
-        
-        Decoder Universe provides educational information designed to help consumers understand sales tactics and protect themselves from manipulation. This platform:
-        
-        • **Is NOT professional advice** - We do not provide financial, legal, real estate, or other professional advice
-        • **Educational content only** - All information is for informational and educational purposes
-        • **No professional relationship** - Use of this platform does not create any advisor-client relationship
-        • **User responsibility** - You assume full responsibility for any decisions based on this information
-        • **No guarantees** - We make no warranties about outcomes from using this information
-        • **Consult professionals** - Always consult qualified professionals for specific advice
-        
-        **LIMITATION OF LIABILITY**
-        
-        To the maximum extent permitted by law, Decoder Universe and its operators shall not be liable for any direct, indirect, incidental, consequential, or punitive damages arising from your use of this platform, including but not limited to financial losses, business interruption, or personal injury.
-        
-        **USER RESPONSIBILITIES**
-        
-        By using this platform, you agree to:
-        • Use information for educational purposes only
-        • Make independent decisions about professional services
-        • Verify all information independently before taking action
-        • Not rely solely on this platform for important decisions
-        • Consult appropriate professionals for advice
-        """)
-    
-    with disclaimer_tabs[1]:
-        st.markdown("""
-        **FINANCIAL SERVICES DISCLAIMER**
-        
-        **NOT INVESTMENT OR FINANCIAL ADVICE**
-        • Content related to financial advisors, fees, and investments is educational only
-        • We are not registered investment advisors, broker-dealers, or financial planners
-        • No content constitutes investment advice, financial planning, or recommendations
-        • Past performance information does not predict future results
-        
-        **REGULATORY COMPLIANCE**
-        • Fee and compensation data is based on publicly available disclosure documents
-        • We encourage users to verify all information with official regulatory sources
-        • Check FINRA BrokerCheck and SEC records for advisor information
-        • Understand that regulations and compensation structures change over time
-        
-        **PROFESSIONAL CONSULTATION REQUIRED**
-        • Always consult licensed financial professionals for personalized advice
-        • Consider fee-only financial advisors for unbiased guidance
-        • Verify all advisor credentials and regulatory standing independently
-        • Make investment decisions based on your individual circumstances
-        """)
-    
-    with disclaimer_tabs[2]:
-        st.markdown("""
-        **REAL ESTATE SERVICES DISCLAIMER**
-        
-        **NOT REAL ESTATE ADVICE**
-        • Content about real estate agents and transactions is educational only
-        • We are not licensed real estate professionals or attorneys
-        • Real estate laws and practices vary by state and locality
-        • No content constitutes real estate or legal advice
-        
-        **MARKET INFORMATION**
-        • Market data and pricing information may not be current or accurate
-        • Real estate values and market conditions change frequently
-        • Always verify market information with local real estate professionals
-        • Obtain current market analyses for specific properties or areas
-        
-        **PROFESSIONAL CONSULTATION REQUIRED**
-        • Consult licensed real estate agents for market guidance
-        • Use qualified real estate attorneys for contract and legal matters
-        • Obtain professional inspections and appraisals
-        • Verify all legal requirements with local authorities
-        """)
-    
-    with disclaimer_tabs[3]:
-        st.markdown("""
-        **AUTOMOTIVE SERVICES DISCLAIMER**
-        
-        **NOT AUTOMOTIVE ADVICE**
-        • Content about car buying and dealership practices is educational only
-        • We are not automotive professionals or consumer finance experts
-        • Vehicle values, financing terms, and regulations vary by location
-        • No content constitutes specific purchasing or financing advice
-        
-        **VEHICLE INFORMATION**
-        • Vehicle values and market data may not be current
-        • Financing terms and incentives change frequently
-        • Always verify vehicle history, condition, and value independently
-        • Obtain professional inspections for used vehicles
-        
-        **PROFESSIONAL CONSULTATION REQUIRED**
-        • Consult automotive professionals for technical advice
-        • Use qualified mechanics for vehicle inspections
-        • Verify financing terms with multiple lenders
-        • Understand your consumer rights under applicable laws
-        """)
-    
-    with disclaimer_tabs[4]:
-        st.markdown("""
-        **FUNERAL SERVICES DISCLAIMER**
-        
-        **NOT LEGAL OR FUNERAL INDUSTRY ADVICE**
-        • Content about funeral homes and services is educational only
-        • We are not funeral industry professionals or attorneys
-        • Funeral regulations and requirements vary by state and locality
-        • No content constitutes legal or professional funeral advice
-        
-        **REGULATORY INFORMATION**
-        • References to FTC Funeral Rule and state laws are for general information
-        • Regulations and requirements may have changed since content creation
-        • Always verify current legal requirements with appropriate authorities
-        • Funeral home practices and pricing vary significantly
-        
-        **PROFESSIONAL CONSULTATION REQUIRED**
-        • Consult funeral industry professionals for specific guidance
-        • Use qualified attorneys for legal matters related to death and estates
-        • Verify all legal requirements with local authorities
-        • Consider emotional support resources during difficult times
-        """)
-    
-    with disclaimer_tabs[5]:
-        st.markdown("""
-        **PRIVACY & DATA PROTECTION**
-        
-        **DATA COLLECTION**
-        • We collect minimal data necessary for platform operation
-        • Document analysis is processed securely and not stored permanently
-        • Usage analytics may be collected to improve the platform
-        • No personal financial information is stored on our servers
-        
-        **THIRD-PARTY SERVICES**
-        • Document analysis uses OpenAI services subject to their privacy policy
-        • Platform hosted on Streamlit Cloud subject to their terms
-        • We do not control third-party data handling practices
-        • Review third-party privacy policies for complete information
-        
-        **DATA SECURITY**
-        • We implement reasonable security measures to protect user data
-        • No system is completely secure - use caution with sensitive information
-        • We are not responsible for unauthorized access beyond our reasonable control
-        • Report security concerns immediately to our support team
-        
-        **USER RIGHTS**
-        • You may request deletion of any data we have collected
-        • You can discontinue use of the platform at any time
-        • Contact us for questions about data handling or privacy concerns
-        • We will respond to privacy requests in accordance with applicable law
-        """)
+    show_legal_page("disclaimers")
 
 def show_terms_of_service():
     """Show terms of service"""
-    st.markdown("### 📜 Terms of Service")
-    
-    terms_tabs = st.tabs(["🎯 User Agreement", "💳 Payment Terms", "🚫 Prohibited Uses", "⚖️ Legal Terms"])
-    
-    with terms_tabs[0]:
-        st.markdown("""
-        **ACCEPTANCE OF TERMS**
-        
-        By accessing and using Decoder Universe, you accept and agree to be bound by these Terms of Service. If you do not agree to these terms, you may not use this platform.
-        
-        **PERMITTED USES**
-        • Educational research and personal knowledge enhancement
-        • Preparation for interactions with sales professionals
-        • Understanding industry practices and consumer protection
-        • Personal reference and decision-making support
-        
-        **ACCOUNT RESPONSIBILITIES**
-        • Provide accurate information if creating an account
-        • Maintain confidentiality of any account credentials
-        • Notify us immediately of unauthorized account access
-        • Use the platform in accordance with these terms
-        
-        **CONTENT ACCURACY**
-        • We strive for accuracy but make no guarantees about content correctness
-        • Information may become outdated or change without notice
-        • Users should verify all information independently
-        • Report inaccuracies to help us improve the platform
-        """)
-    
-    with terms_tabs[1]:
-        st.markdown("""
-        **FOUNDING MEMBER TERMS**
-        
-        **LIFETIME ACCESS**
-        • Founding membership grants lifetime access to current and future decoder applications
-        • Access includes all premium features and content available at time of payment
-        • New features and decoders will be added to your lifetime access at no additional cost
-        
-        **PAYMENT PROCESSING**
-        • Payments processed securely through Stripe payment systems
-        • All sales are final - no refunds after access is granted
-        • Payment confirmation required before premium access is activated
-        • Contact support within 24 hours for payment processing issues
-        
-        **SERVICE AVAILABILITY**
-        • We strive for 99% uptime but cannot guarantee continuous availability
-        • Scheduled maintenance will be announced in advance when possible
-        • Premium access may be temporarily unavailable during system updates
-        • No refunds for temporary service interruptions
-        """)
-    
-    with terms_tabs[2]:
-        st.markdown("""
-        **PROHIBITED ACTIVITIES**
-        
-        You may NOT use this platform to:
-        • Provide professional advice to others without proper licensing
-        • Reproduce, distribute, or sell platform content without permission
-        • Attempt to reverse engineer or copy platform functionality
-        • Upload malicious files or attempt to compromise platform security
-        • Use automated systems to access or scrape platform content
-        • Violate any applicable laws or regulations
-        • Harass other users or platform operators
-        • Misrepresent your identity or credentials
-        
-        **CONTENT GUIDELINES**
-        • Document uploads should be legitimate personal documents only
-        • Do not upload documents containing others' personal information
-        • Do not upload copyrighted materials you don't have rights to analyze
-        • We reserve the right to refuse analysis of inappropriate content
-        
-        **ENFORCEMENT**
-        • Violations may result in immediate termination of access
-        • We reserve the right to refuse service to anyone
-        • Legal action may be pursued for serious violations
-        • No refunds for termination due to terms violations
-        """)
-    
-    with terms_tabs[3]:
-        st.markdown("""
-        **LEGAL PROVISIONS**
-        
-        **INTELLECTUAL PROPERTY**
-        • All platform content, design, and functionality is proprietary
-        • Users retain rights to documents they upload for analysis
-        • Analysis results are provided for user's personal use only
-        • No license granted for commercial use of platform content
-        
-        **DISPUTE RESOLUTION**
-        • Good faith effort to resolve disputes directly before legal action
-        • Disputes subject to jurisdiction where platform operators are located
-        • Arbitration may be required for certain types of disputes
-        • Class action lawsuits are waived to the extent permitted by law
-        
-        **CHANGES TO TERMS**
-        • Terms may be updated periodically with reasonable notice
-        • Continued use after changes constitutes acceptance of new terms
-        • Material changes will be highlighted and require explicit acceptance
-        • Users may discontinue use if they disagree with term changes
-        
-        **CONTACT INFORMATION**
-        • Questions about terms should be directed to platform support
-        • Legal notices should be sent to designated contact address
-        • We will respond to legitimate inquiries within reasonable time
-        • Emergency security issues should be reported immediately
-        """)
+    show_legal_page("terms")
 
 # Session state initialization
 if 'is_premium' not in st.session_state:
@@ -608,199 +2789,11 @@ if 'is_premium' not in st.session_state:
 if 'current_decoder' not in st.session_state:
     st.session_state.current_decoder = None
 
-# Decoder data structure with preview vs premium content
-DECODERS = {
-    "financial_advisor": {
-        "name": "Financial Advisor Decoder",
-        "icon": "💰",
-        "description": "Protect yourself from high-pressure financial advisor sales tactics",
-        "is_available": True,
-        "preview_tactics": [
-            "Creating artificial urgency: 'This offer expires today!'",
-            "Fear-mongering about market crashes",
-            "Using complex jargon to confuse clients"
-        ],
-        "premium_tactics": [
-            "The 5-Stage Psychological Manipulation Process: PREPARE (planning influence), CONNECT (false intimacy), EXPLORE (extracting vulnerabilities), PRESENT (using your words against you), DEVELOP (securing the close)",
-            "Variable compensation 55-80% creates bias - advisors at major firms earn more from complex products vs simple investments",
-            "Revenue sharing agreements with fund companies - advisors get paid by investment companies to sell their products",
-            "The 'FIND' questioning technique: Facts (your situation), Issues (pain points), Needs (what you want), Drivers (emotional triggers)",
-            "State of mind manipulation - trained to manage your emotional state during meetings to increase receptivity",
-            "Real compensation data: Company A pays 0.001 rate for Wealth Services vs 0.0001 for Money Market (10x difference)",
-            "Company B relationship pay: 32-42 basis points for managed accounts vs 9-12 for self-directed (3-4x difference)",
-            "Solutions pay bonuses: $200 per $100k enrolled in advisory programs creates enrollment bias",
-            "Asset consolidation incentives: $80 per $100k transferred creates pressure to move your accounts",
-            "Annual engagement fees on your balances - ongoing payments based on what you invest in"
-        ],
-        "preview_tips": [
-            "Always ask for fee disclosures in writing",
-            "Take time to research any recommendation",
-            "Get a second opinion from a fee-only advisor"
-        ],
-        "premium_tips": [
-            "Essential first meeting questions: 'How exactly are you compensated? Are you a fiduciary at all times? Do you receive money from fund companies?'",
-            "Fee negotiation: Fees are often negotiable, especially for larger accounts - ask for written breakdown and compare to industry averages",
-            "Decode advisor-speak: 'Let's diversify your portfolio' = I want fees from multiple sources. 'Professional management' = I earn more from managed accounts",
-            "Use the meeting prep tool: Bring specific questions about their compensation structure and document their answers",
-            "Conflict identification: Look for commission-based compensation, proprietary products, revenue sharing, sales contests, referral bonuses",
-            "Check FINRA BrokerCheck for complaints and disciplinary actions before meeting",
-            "Understand fiduciary vs suitability standards - fiduciaries must act in your best interest at ALL times",
-            "Calculate total cost of ownership: Include management fees, platform fees, fund expenses, and trading costs",
-            "Company-specific protections: Company C charges $175 annual fees unless you have $500k+ - know these pressure tactics",
-            "Use their psychology against them: Ask 'What would you recommend if you weren't paid differently for various products?'"
-        ],
-        "preview_flags": [
-            "Refuses to explain fees clearly",
-            "Pushes immediate decisions",
-            "Only recommends high-fee products"
-        ],
-        "premium_flags": [
-            "Psychological red flag phrases: 'This is what I use for my own family', 'You need to act quickly', 'Don't worry about the fees'",
-            "State manipulation tactics: Meeting designed to impress/intimidate, using your fears to create urgency, making you feel special",
-            "The 5-stage process in action: Overly structured meetings, questions designed to find vulnerabilities, using your own words against you",
-            "Compensation-driven recommendations: Only suggesting products from companies with revenue sharing agreements",
-            "False scarcity tactics: 'This opportunity won't be available next week', 'I can only offer this rate if you decide today'",
-            "EXPLORE stage red flags: Questions like 'What keeps you up at night about money?' designed to find emotional pressure points",
-            "PRESENT stage manipulation: 'Remember when you said your biggest fear was...' using your vulnerabilities against you",
-            "Revenue sharing concealment: Mentions fund performance but won't disclose they receive payments from fund companies",
-            "Annual fee pressure: Company C-style tactics pressuring you toward advisory accounts to 'waive' fees",
-            "Referral payment conflicts: Introducing you to 'specialists' because they earn $450-$3,500 referral bonuses"
-        ]
-    },
-    "real_estate": {
-        "name": "Real Estate Agent Decoder",
-        "icon": "🏠",
-        "description": "Navigate high-pressure real estate tactics and understand what agents really mean",
-        "is_available": True,
-        "preview_tactics": [
-            "'Other buyers are interested' - creating false competition",
-            "Suggesting inflated listing prices to win business",
-            "Rushing you through property viewings"
-        ],
-        "premium_tactics": [
-            "Dual agency without proper disclosure",
-            "Steering buyers away from certain neighborhoods",
-            "Withholding negative property information",
-            "Pocket listings to benefit preferred buyers",
-            "Inflating comparable sales data"
-        ],
-        "preview_tips": [
-            "Research comparable sales yourself",
-            "Get pre-approved financing before hunting",
-            "Take time between viewing and deciding"
-        ],
-        "premium_tips": [
-            "Understand agency relationships and fiduciary duties",
-            "Use independent home inspectors and appraisers",
-            "Research neighborhood crime, schools, and development plans",
-            "Know your rights under state real estate disclosure laws",
-            "Negotiate commission rates and terms upfront"
-        ],
-        "preview_flags": [
-            "Pressures you to make offers without inspection",
-            "Won't provide market analysis",
-            "Discourages negotiating"
-        ],
-        "premium_flags": [
-            "Represents both parties without clear written disclosure",
-            "Rushes you through contract signing",
-            "Discourages attorney review of contracts",
-            "Won't provide references from recent clients",
-            "Shows properties only during optimal conditions"
-        ]
-    },
-    "car_salesman": {
-        "name": "Car Salesman Decoder",
-        "icon": "🚗",
-        "description": "Decode car dealership tricks and negotiate with confidence",
-        "is_available": True,
-        "preview_tactics": [
-            "Four-square method to confuse pricing",
-            "'What payment can you afford?' approach",
-            "Bait and switch with advertised cars"
-        ],
-        "premium_tactics": [
-            "Yo-yo financing - calling back after deal is signed",
-            "Packing payments with unnecessary add-ons",
-            "Spot delivery before financing is finalized",
-            "Trade-in lowballing and equity manipulation",
-            "Extended warranty fear tactics"
-        ],
-        "preview_tips": [
-            "Research vehicle value using KBB and Edmunds",
-            "Get financing pre-approved from bank",
-            "Negotiate total price, not monthly payment"
-        ],
-        "premium_tips": [
-            "Understand dealer holdback and manufacturer incentives",
-            "Know the difference between invoice and MSRP",
-            "Get all agreements in writing before signing",
-            "Understand your right to cancel extended warranties",
-            "Know lemon law protections in your state"
-        ],
-        "preview_flags": [
-            "Won't let you take car to mechanic",
-            "Refuses to negotiate or provide estimates",
-            "Adds surprise fees at signing"
-        ],
-        "premium_flags": [
-            "Changes terms after verbal agreement",
-            "Pressures you to buy same day with 'manager specials'",
-            "Won't explain financing terms line by line",
-            "Insists on spot delivery before loan approval",
-            "Makes verbal promises not included in written contract"
-        ]
-    },
-    "funeral_director": {
-        "name": "Funeral Home Director Decoder",
-        "icon": "⚱️",
-        "description": "Navigate funeral arrangements with confidence and avoid unnecessary upselling during difficult times",
-        "is_available": True,
-        "preview_tactics": [
-            "Exploiting grief to upsell expensive packages",
-            "Suggesting cheaper options show 'lack of love'",
-            "Bundling unnecessary services together"
-        ],
-        "premium_tactics": [
-            "Claiming embalming is required when it's not",
-            "Refusing to show basic casket options first",
-            "Adding unauthorized charges for 'standard' services",
-            "Pressuring immediate payment in full",
-            "Misrepresenting legal requirements"
-        ],
-        "preview_tips": [
-            "Ask for itemized price lists (required by law)",
-            "Know you can purchase caskets elsewhere",
-            "Understand embalming is rarely required"
-        ],
-        "premium_tips": [
-            "Know your rights under the FTC Funeral Rule",
-            "Understand the difference between burial and cremation costs",
-            "Get multiple quotes for comparison",
-            "Know which services are actually required by law",
-            "Understand pre-need contract protections and cancellation rights"
-        ],
-        "preview_flags": [
-            "Won't provide written price lists",
-            "Claims services are 'required' when optional",
-            "Pressures immediate expensive decisions"
-        ],
-        "premium_flags": [
-            "Refuses to accept caskets from other vendors",
-            "Won't itemize charges or explain fees",
-            "Discourages price shopping with other funeral homes",
-            "Makes verbal promises not included in written contracts",
-            "Charges for services without authorization"
-        ]
-    }
-}
+# Decoder data structure with preview vs premium content, loaded from content/decoders/
+DECODERS = DecoderCatalog(get_content_store())
 
 # Coming Soon decoders
-COMING_SOON = [
-    {"name": "Timeshare Decoder", "icon": "🏖️", "description": "Escape timeshare presentation traps and high-pressure vacation sales"},
-    {"name": "Crypto Decoder", "icon": "₿", "description": "Identify cryptocurrency scams and predatory investment schemes"},
-    {"name": "Insurance Decoder", "icon": "🛡️", "description": "Navigate insurance sales tactics and understand policy fine print"}
-]
+COMING_SOON = get_content_store().manifest()["coming_soon"]
 
 def show_premium_upgrade():
     """Display premium upgrade call-to-action"""
@@ -828,6 +2821,156 @@ def show_premium_upgrade():
             st.success("🎉 Welcome, Founding Member! You now have lifetime access to ALL decoders and future releases.")
             st.rerun()
 
+# Searchable decoder sections: (content field, label shown in results, founding-member only)
+SEARCH_SECTIONS = [
+    ("preview_tactics", "⚠️ Tactics", False),
+    ("premium_tactics", "⚠️ Tactics", True),
+    ("preview_tips", "🛡️ Protection Tips", False),
+    ("premium_tips", "🛡️ Protection Tips", True),
+    ("preview_flags", "🚩 Red Flags", False),
+    ("premium_flags", "🚩 Red Flags", True)
+]
+SEARCH_RESULT_LIMIT = 10
+
+def tokenize(text):
+    """Lower-case word tokens used by the search index"""
+    return re.findall(r"[a-z0-9$%]+(?:['.][a-z0-9]+)*", text.lower())
+
+class SearchIndex:
+    """In-memory inverted index over decoder content with prefix matching and TF-IDF ranking"""
+    
+    def __init__(self):
+        self._documents = {}  # doc id -> {"decoder_key", "section", "is_premium", "text"}
+        self._normalized = {}  # doc id -> space-joined tokens for phrase matching
+        self._postings = {}  # token -> {doc id: term frequency}
+        self._decoder_docs = {}  # decoder key -> (content version, [doc ids])
+        self._vocabulary = []  # sorted tokens for prefix lookups, rebuilt lazily
+        self._vocabulary_dirty = False
+        self._next_id = 0
+        self._lock = threading.Lock()
+    
+    def sync(self, decoders, version_of):
+        """Re-index only the decoders whose content version changed, and drop removed ones"""
+        with self._lock:
+            current_keys = set(decoders)
+            for decoder_key in list(self._decoder_docs):
+                if decoder_key not in current_keys:
+                    self._remove_decoder(decoder_key)
+            for decoder_key in current_keys:
+                version = version_of(decoder_key)
+                indexed = self._decoder_docs.get(decoder_key)
+                if indexed is None or indexed[0] != version:
+                    self._remove_decoder(decoder_key)
+                    self._add_decoder(decoder_key, decoders[decoder_key], version)
+    
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        """Ranked hits for every query word; the last word also matches as a prefix"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        
+        with self._lock:
+            if self._vocabulary_dirty:
+                self._vocabulary = sorted(self._postings)
+                self._vocabulary_dirty = False
+            
+            scores = None
+            for position, token in enumerate(tokens):
+                matches = [token] if position < len(tokens) - 1 else self._prefix_matches(token)
+                token_scores = {}
+                for match in matches:
+                    postings = self._postings.get(match, {})
+                    idf = math.log(1 + len(self._documents) / (1 + len(postings)))
+                    # Exact matches outrank prefix completions
+                    weight = idf if match == token else idf * 0.5
+                    for doc_id, frequency in postings.items():
+                        token_scores[doc_id] = token_scores.get(doc_id, 0) + frequency * weight
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {doc_id: score + token_scores[doc_id] for doc_id, score in scores.items() if doc_id in token_scores}
+                if not scores:
+                    return []
+            
+            # Bonus for documents containing the query as a phrase
+            phrase = " ".join(tokens)
+            ranked = sorted(
+                scores.items(),
+                key=lambda item: -(item[1] * (2 if phrase in self._normalized[item[0]] else 1))
+            )
+            return [dict(self._documents[doc_id], score=score) for doc_id, score in ranked[:limit]]
+    
+    def _prefix_matches(self, prefix):
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        matches = []
+        for token in self._vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            matches.append(token)
+        return matches
+    
+    def _add_decoder(self, decoder_key, decoder, version):
+        entries = [("name", "📋 Overview", False, f"{decoder['name']} - {decoder['description']}")]
+        for field, label, is_premium in SEARCH_SECTIONS:
+            entries.extend((field, label, is_premium, text) for text in decoder[field])
+        
+        doc_ids = []
+        for _, label, is_premium, text in entries:
+            doc_id = self._next_id
+            self._next_id += 1
+            self._documents[doc_id] = {"decoder_key": decoder_key, "section": label, "is_premium": is_premium, "text": text}
+            tokens = tokenize(text)
+            self._normalized[doc_id] = " ".join(tokens)
+            for token in tokens:
+                postings = self._postings.setdefault(token, {})
+                postings[doc_id] = postings.get(doc_id, 0) + 1
+            doc_ids.append(doc_id)
+        
+        self._decoder_docs[decoder_key] = (version, doc_ids)
+        self._vocabulary_dirty = True
+    
+    def _remove_decoder(self, decoder_key):
+        _, doc_ids = self._decoder_docs.pop(decoder_key, (None, []))
+        for doc_id in doc_ids:
+            del self._documents[doc_id]
+            for token in set(self._normalized.pop(doc_id).split()):
+                postings = self._postings[token]
+                del postings[doc_id]
+                if not postings:
+                    del self._postings[token]
+        self._vocabulary_dirty = True
+
+@st.cache_resource
+def get_search_index():
+    """Process-wide search index, built on first use"""
+    return SearchIndex()
+
+def search_decoders(query):
+    """Search all decoder content, re-indexing any decoder whose content file changed"""
+    index = get_search_index()
+    index.sync(DECODERS, get_content_store().decoder_version)
+    return index.search(query)
+
+def show_search_results(query):
+    """Render search hits, hiding founding-member text from free users"""
+    results = search_decoders(query)
+    if not results:
+        st.caption(f"No matches for \"{query}\"")
+        return
+    
+    for i, result in enumerate(results):
+        decoder = DECODERS[result["decoder_key"]]
+        text_col, button_col = st.columns([5, 1])
+        with text_col:
+            if result["is_premium"] and not st.session_state.is_premium:
+                st.markdown(f"{decoder['icon']} **{decoder['name']}** · {result['section']}  \n🔒 *Founding member content matches your search*")
+            else:
+                st.markdown(f"{decoder['icon']} **{decoder['name']}** · {result['section']}  \n{result['text']}")
+        with button_col:
+            if st.button("Open", key=f"search_open_{i}", use_container_width=True):
+                st.session_state.current_decoder = result["decoder_key"]
+                st.rerun()
+
 def show_dashboard():
     st.markdown("""
     <div class="main-header">
@@ -842,6 +2985,15 @@ def show_dashboard():
     else:
         st.info("🔍 **Free Preview Mode** - Join our founding members for lifetime access to everything")
     
+    # Search across every decoder's tactics, tips and red flags
+    search_query = st.text_input(
+        "🔎 Search all decoders",
+        placeholder="e.g. dual agency, revenue sharing, embalming",
+        key="decoder_search"
+    )
+    if search_query.strip():
+        show_search_results(search_query.strip())
+    
     st.markdown("### Available Decoders")
     
     # Main decoders in 2x2 grid
@@ -894,9 +3046,10 @@ def show_dashboard():
     st.markdown("### 🚀 Coming Soon")
     st.markdown("*Expanding our protection universe with these upcoming decoders:*")
     
+    # The manifest can list any number of decoders; extra ones wrap onto the same three columns
     coming_cols = st.columns(3)
     for i, decoder in enumerate(COMING_SOON):
-        with coming_cols[i]:
+        with coming_cols[i % len(coming_cols)]:
             st.markdown(f"""
             <div style="text-align: center; padding: 1rem; border: 2px dashed #ccc; border-radius: 10px; margin: 0.5rem 0;">
                 <div style="font-size: 2rem; margin-bottom: 0.5rem;">{decoder['icon']}</div>
@@ -953,6 +3106,77 @@ def show_dashboard():
     </div>
     """, unsafe_allow_html=True)
 
+# Layout of the three decoder detail columns: preview items, then premium items or a locked teaser
+DECODER_DETAIL_SECTIONS = [
+    {
+        "heading": "### ⚠️ Common Tactics",
+        "css_class": "tactic-warning",
+        "preview_key": "preview_tactics",
+        "preview_label": "Tactic",
+        "premium_key": "premium_tactics",
+        "premium_heading": "**🌟 Founding Member Tactics:**",
+        "premium_label": "Advanced",
+        "locked_html": """<div class="premium-overlay">
+<strong>🔒 Founding Member Feature</strong><br>
+Unlock 5+ additional advanced tactics used by industry professionals.<br>
+<em>Founding members get ALL current and future decoder content - forever!</em>
+</div>"""
+    },
+    {
+        "heading": "### 🛡️ Protection Tips",
+        "css_class": "protection-tip",
+        "preview_key": "preview_tips",
+        "preview_label": "Protect",
+        "premium_key": "premium_tips",
+        "premium_heading": "**🌟 Founding Member Protection:**",
+        "premium_label": "Advanced",
+        "locked_html": """<div class="premium-overlay">
+<strong>🔒 Founding Member Feature</strong><br>
+Access 5+ expert-level protection strategies across ALL industries.<br>
+<em>Lifetime access = comprehensive defense for every sales situation.</em>
+</div>"""
+    },
+    {
+        "heading": "### 🚩 Red Flags",
+        "css_class": "red-flag",
+        "preview_key": "preview_flags",
+        "preview_label": "Warning",
+        "premium_key": "premium_flags",
+        "premium_heading": "**🌟 Founding Member Red Flags:**",
+        "premium_label": "Critical",
+        "locked_html": """<div class="premium-overlay">
+<strong>🔒 Founding Member Feature</strong><br>
+Discover 5+ critical warning signs across ALL decoder categories.<br>
+<em>Founding members get expert red flags for every sales scenario - forever!</em>
+</div>"""
+    }
+]
+
+@st.cache_data(show_spinner=False)
+def build_decoder_detail_fragments(decoder_key, is_premium, content_version):
+    """Markdown/HTML for the tactics, tips and flags columns, built once per decoder, access level and content version"""
+    decoder = DECODERS[decoder_key]
+    fragments = []
+    
+    for section in DECODER_DETAIL_SECTIONS:
+        # HTML blocks are separated by blank lines so the markdown headings still render
+        blocks = [section["heading"]]
+        blocks.extend(
+            f'<div class="{section["css_class"]}"><strong>{section["preview_label"]}:</strong> {item}</div>'
+            for item in decoder[section["preview_key"]]
+        )
+        if is_premium:
+            blocks.append(section["premium_heading"])
+            blocks.extend(
+                f'<div class="{section["css_class"]}"><strong>{section["premium_label"]}:</strong> {item}</div>'
+                for item in decoder[section["premium_key"]]
+            )
+        else:
+            blocks.append(section["locked_html"])
+        fragments.append("\n\n".join(blocks))
+    
+    return fragments
+
 def show_decoder_detail(decoder_key):
     decoder = DECODERS[decoder_key]
     
@@ -971,95 +3195,13 @@ def show_decoder_detail(decoder_key):
     </div>
     """, unsafe_allow_html=True)
     
-    # Create three columns for content
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        st.markdown("### ⚠️ Common Tactics")
-        
-        # Show preview tactics
-        for tactic in decoder['preview_tactics']:
-            st.markdown(f"""
-            <div class="tactic-warning">
-                <strong>Tactic:</strong> {tactic}
-            </div>
-            """, unsafe_allow_html=True)
-        
-        # Show premium tactics if user has premium
-        if st.session_state.is_premium:
-            st.markdown("**🌟 Founding Member Tactics:**")
-            for tactic in decoder['premium_tactics']:
-                st.markdown(f"""
-                <div class="tactic-warning">
-                    <strong>Advanced:</strong> {tactic}
-                </div>
-                """, unsafe_allow_html=True)
-        else:
-            st.markdown("""
-            <div class="premium-overlay">
-                <strong>🔒 Founding Member Feature</strong><br>
-                Unlock 5+ additional advanced tactics used by industry professionals.<br>
-                <em>Founding members get ALL current and future decoder content - forever!</em>
-            </div>
-            """, unsafe_allow_html=True)
-    
-    with col2:
-        st.markdown("### 🛡️ Protection Tips")
-        
-        # Show preview tips
-        for tip in decoder['preview_tips']:
-            st.markdown(f"""
-            <div class="protection-tip">
-                <strong>Protect:</strong> {tip}
-            </div>
-            """, unsafe_allow_html=True)
-        
-        # Show premium tips if user has premium
-        if st.session_state.is_premium:
-            st.markdown("**🌟 Founding Member Protection:**")
-            for tip in decoder['premium_tips']:
-                st.markdown(f"""
-                <div class="protection-tip">
-                    <strong>Advanced:</strong> {tip}
-                </div>
-                """, unsafe_allow_html=True)
-        else:
-            st.markdown("""
-            <div class="premium-overlay">
-                <strong>🔒 Founding Member Feature</strong><br>
-                Access 5+ expert-level protection strategies across ALL industries.<br>
-                <em>Lifetime access = comprehensive defense for every sales situation.</em>
-            </div>
-            """, unsafe_allow_html=True)
-    
-    with col3:
-        st.markdown("### 🚩 Red Flags")
-        
-        # Show preview flags
-        for flag in decoder['preview_flags']:
-            st.markdown(f"""
-            <div class="red-flag">
-                <strong>Warning:</strong> {flag}
-            </div>
-            """, unsafe_allow_html=True)
-        
-        # Show premium flags if user has premium
-        if st.session_state.is_premium:
-            st.markdown("**🌟 Founding Member Red Flags:**")
-            for flag in decoder['premium_flags']:
-                st.markdown(f"""
-                <div class="red-flag">
-                    <strong>Critical:</strong> {flag}
-                </div>
-                """, unsafe_allow_html=True)
-        else:
-            st.markdown("""
-            <div class="premium-overlay">
-                <strong>🔒 Founding Member Feature</strong><br>
-                Discover 5+ critical warning signs across ALL decoder categories.<br>
-                <em>Founding members get expert red flags for every sales scenario - forever!</em>
-            </div>
-            """, unsafe_allow_html=True)
+    # Create three columns for content, each rendered as one pre-built fragment
+    fragments = build_decoder_detail_fragments(
+        decoder_key, st.session_state.is_premium, get_content_store().decoder_version(decoder_key)
+    )
+    for column, fragment in zip(st.columns(3), fragments):
+        with column:
+            st.markdown(fragment, unsafe_allow_html=True)
     
     # Founding Member App Access
     if st.session_state.is_premium:
@@ -1128,7 +3270,49 @@ def show_decoder_detail(decoder_key):
         "• Bring a trusted friend or advisor"
     )
 
+def show_admin_panel():
+    """Sidebar metrics panel, only available when ADMIN_TOKEN is configured"""
+    admin_token = get_setting("ADMIN_TOKEN")
+    if not admin_token:
+        return
+    
+    with st.sidebar.expander("🔧 Admin"):
+        entered_token = st.text_input("Admin token", type="password", key="admin_token")
+        if not hmac.compare_digest(entered_token.encode("utf-8"), str(admin_token).encode("utf-8")):
+            return
+        
+        metrics = get_pipeline_metrics()
+        st.json(metrics.snapshot())
+        st.download_button(
+            label="📥 Download Prometheus metrics",
+            data=metrics.to_prometheus(),
+            file_name="decoder_universe_metrics.txt",
+            mime="text/plain"
+        )
+
+        # Aggregates over every stored analysis, computed in SQLite from the JSON columns
+        store = get_analysis_result_store()
+        if store is not None:
+            st.write("**Most common fees**")
+            st.dataframe(
+                [{"Fee": item, "Documents": documents, "Average amount ($)": average_amount, "Average rate (%)": average_percent}
+                 for item, documents, average_amount, average_percent in store.top_fees()],
+                use_container_width=True
+            )
+            flag_counts = store.red_flag_counts()
+            st.write("**Red flags by severity:** " + " · ".join(
+                f"{SEVERITY_ICONS[severity]} {flag_counts.get(severity, 0)}" for severity in SCAN_SEVERITIES
+            ))
+
 def main():
+    inject_stylesheet()
+    
+    # Optional Prometheus scrape endpoint, started once per process
+    metrics_port = get_setting("METRICS_PORT")
+    if metrics_port:
+        start_metrics_server(get_setting("METRICS_HOST", "127.0.0.1"), int(metrics_port))
+    show_admin_panel()
+    
     # Initialize session state for legal pages
     if 'show_legal' not in st.session_state:
         st.session_state.show_legal = False
@@ -1156,59 +3340,16 @@ def main():
         if st.button("← Back to Decoder Universe", key="back_from_privacy"):
             st.session_state.show_privacy = False
             st.rerun()
-        st.markdown("### 🔒 Privacy Policy")
-        st.markdown("""
-        **DATA COLLECTION & USE**
-        
-        Decoder Universe collects minimal data to provide educational services:
-        
-        **Information We Collect:**
-        • Usage analytics (pages visited, features used) to improve the platform
-        • Document content temporarily for AI analysis (not stored permanently)
-        • Payment information (processed securely through Stripe, not stored by us)
-        • Account status (free vs founding member) to control access
-        
-        **How We Use Information:**
-        • Provide document analysis services through OpenAI API
-        • Improve platform functionality and user experience
-        • Verify founding member status for premium access
-        • Communicate important service updates
-        
-        **Information Sharing:**
-        • Document content shared with OpenAI for analysis (subject to their privacy policy)
-        • Payment processing through Stripe (subject to their privacy policy)
-        • We do not sell or share personal information with other third parties
-        • Anonymous usage statistics may be shared for research purposes
-        
-        **Data Security:**
-        • All data transmission encrypted using industry-standard protocols
-        • Document analysis performed securely and content not permanently stored
-        • Access controls protect against unauthorized data access
-        • Regular security assessments and updates to protect user information
-        
-        **Your Rights:**
-        • Request deletion of any data we have collected about you
-        • Ask questions about our data handling practices
-        • Discontinue use of the platform at any time
-        • Contact us to exercise your privacy rights
-        
-        **Contact for Privacy Matters:**
-        • Email privacy questions to: [insert contact email]
-        • We will respond to privacy requests within 30 days
-        • Report security concerns immediately for prompt investigation
-        
-        **Updates to Privacy Policy:**
-        • We may update this policy to reflect changes in our practices
-        • Material changes will be announced prominently on the platform
-        • Continued use after changes constitutes acceptance of updated policy
-        """)
+        show_legal_page("privacy")
         return
     
     # Show appropriate page based on navigation
     if st.session_state.current_decoder:
-        show_decoder_detail(st.session_state.current_decoder)
+        with get_pipeline_metrics().timed("render", page="decoder_detail"):
+            show_decoder_detail(st.session_state.current_decoder)
     else:
-        show_dashboard()
+        with get_pipeline_metrics().timed("render", page="dashboard"):
+            show_dashboard()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,20 @@
+"""Document parsing functions run in the extraction process pool.
+
+They live in their own module so worker processes can import them without
+executing the Streamlit app script.
+"""
+import io
+
+import PyPDF2
+import docx
+
+
+def extract_pdf_pages(data, start, stop):
+    """Extract the text of pages [start, stop) from raw PDF bytes"""
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(data))
+    return [pdf_reader.pages[index].extract_text() or "" for index in range(start, stop)]
+
+
+def extract_docx_paragraphs(data):
+    """Extract the text of every paragraph from raw DOCX bytes"""
+    return [paragraph.text for paragraph in docx.Document(io.BytesIO(data)).paragraphs]
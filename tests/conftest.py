@@ -0,0 +1,11 @@
+import os
+import sys
+
+# Tests import the app module directly; keep it offline and away from the shared temp-dir databases
+os.environ.update({
+    "LLM_BACKEND": "mock",
+    "ANALYSIS_CACHE_PATH": "",
+    "ANALYSIS_RESULTS_PATH": "",
+    "ANALYSIS_HISTORY_PATH": "",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,65 @@
+import time
+
+import decoder_universe
+from decoder_universe import AnalysisHistory, AnalysisJobQueue, MockBackend
+
+class FailingBackend(MockBackend):
+    """Mock backend whose replies fail for prompts containing "fail me" """
+    
+    def complete(self, prompt, settings, priority):
+        if "fail me" in prompt:
+            raise RuntimeError("upstream 500")
+        return super().complete(prompt, settings, priority)
+
+def wait_for(job_queue, job_id):
+    deadline = time.monotonic() + 30
+    while job_queue.get(job_id).is_active:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return job_queue.get(job_id)
+
+def batch_document(name, text):
+    return {
+        "file_name": name, "content_hash": name, "pages": None, "characters": len(text), "red_flags": 0,
+        "duplicate_of": None, "status": "queued", "result": None
+    }
+
+def test_failed_analyses_are_not_saved_to_history(monkeypatch, tmp_path):
+    history = AnalysisHistory(str(tmp_path / "history.sqlite3"), retention_seconds=3600, max_entries=100)
+    monkeypatch.setattr(decoder_universe, "get_analysis_history", lambda: history)
+    monkeypatch.setattr(decoder_universe, "get_llm_backend", lambda: FailingBackend())
+    job_queue = AnalysisJobQueue(max_workers=1, retention_seconds=3600)
+    
+    texts = {"a.txt": "Documentation fee $499", "b.txt": "fail me: Dealer prep $1,295"}
+    documents = [batch_document(name, text) for name, text in texts.items()]
+    job = wait_for(job_queue, job_queue.submit_batch(documents, texts, ["car_salesman"], history_owner="owner"))
+    assert {document["file_name"]: document["status"] for document in job.documents} == {"a.txt": "done", "b.txt": "failed"}
+    assert [entry["file_name"] for entry in history.page("owner")] == ["a.txt"]
+    
+    job = wait_for(job_queue, job_queue.submit("fail me", "c.txt", ["car_salesman", "financial_advisor"], history_owner="owner"))
+    assert "upstream 500" in job.result
+    assert [entry["file_name"] for entry in history.page("owner")] == ["a.txt"]
+
+def test_finished_jobs_have_a_finish_time(monkeypatch):
+    monkeypatch.setattr(decoder_universe, "get_llm_backend", lambda: MockBackend(latency_seconds=0.05))
+    job_queue = AnalysisJobQueue(max_workers=1, retention_seconds=3600)
+    job_id = job_queue.submit("Documentation fee $499", "a.txt", ["car_salesman", "financial_advisor"])
+    
+    # Pages format finished_at as soon as the job stops being active
+    deadline = time.monotonic() + 30
+    while job_queue.get(job_id).is_active:
+        assert time.monotonic() < deadline
+    job = job_queue.get(job_id)
+    assert job.status == "done"
+    assert job.finished_at is not None
+
+def test_forgotten_history_gets_no_entries_from_running_jobs(monkeypatch, tmp_path):
+    history = AnalysisHistory(str(tmp_path / "history.sqlite3"), retention_seconds=3600, max_entries=100)
+    monkeypatch.setattr(decoder_universe, "get_analysis_history", lambda: history)
+    monkeypatch.setattr(decoder_universe, "get_llm_backend", lambda: MockBackend(latency_seconds=0.2))
+    job_queue = AnalysisJobQueue(max_workers=1, retention_seconds=3600)
+    
+    job_id = job_queue.submit("Documentation fee $499", "a.txt", ["car_salesman"], history_owner="owner")
+    job_queue.forget_history_owner(history, "owner")
+    assert wait_for(job_queue, job_id).status == "done"
+    assert history.count("owner") == 0
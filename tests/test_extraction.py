@@ -0,0 +1,80 @@
+import decoder_universe
+from decoder_universe import PDF_MIME_TYPE, TEXT_MIME_TYPE, extract_document
+
+def test_failures_are_not_cached(monkeypatch):
+    attempts = []
+    
+    def failing_chunks(file, file_type=None, max_pages=None):
+        attempts.append(file_type)
+        raise TimeoutError("parsing took longer than 120 seconds")
+        yield
+    
+    monkeypatch.setattr(decoder_universe, "iter_document_chunks", failing_chunks)
+    for _ in range(2):
+        extraction = extract_document("failing-pdf", PDF_MIME_TYPE, b"%PDF-1.4", 10, 1000)
+        assert extraction["text"] is None
+        assert "took longer" in extraction["error"]
+    assert len(attempts) == 2
+
+def test_text_is_extracted_and_cached():
+    data = b"Documentation fee $499\nDealer prep $1,295\n"
+    first = extract_document("text-upload", TEXT_MIME_TYPE, data, 10, 1000)
+    assert first["error"] is None
+    assert first["text"] == data.decode("utf-8")
+    # Memoized by content hash, so the bytes are not parsed again
+    assert extract_document("text-upload", TEXT_MIME_TYPE, b"", 10, 1000) == first
+
+def test_unsupported_types_are_reported():
+    assert "Unsupported file type" in extract_document("image", "image/png", b"", 10, 1000)["error"]
+
+def test_worker_timeout_ignores_time_spent_queued(monkeypatch):
+    import time
+    from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+    
+    from decoder_universe import get_extraction_worker_slots, submit_to_worker, worker_result
+    
+    monkeypatch.setenv("EXTRACT_PROCESS_WORKERS", "1")
+    get_extraction_worker_slots.clear()
+    try:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            busy, _ = submit_to_worker(pool, time.sleep, 1.0)
+            # Waits about a second for the only worker, then runs for 0.1 seconds
+            queued, started_at = submit_to_worker(pool, time.sleep, 0.1)
+            assert busy.done()
+            assert worker_result(queued, started_at, 0.5) is None
+            
+            slow, started_at = submit_to_worker(pool, time.sleep, 2.0)
+            try:
+                worker_result(slow, started_at, 0.3)
+            except FuturesTimeoutError:
+                assert time.monotonic() - started_at < 1.5
+            else:
+                raise AssertionError("expected a timeout")
+    finally:
+        get_extraction_worker_slots.clear()
+
+def test_terminating_a_pool_stops_busy_workers():
+    import time
+    from concurrent.futures.process import BrokenProcessPool
+    
+    from decoder_universe import get_extraction_process_pool, terminate_pool_workers
+    
+    get_extraction_process_pool.clear()
+    pool = get_extraction_process_pool()
+    try:
+        assert pool._mp_context.get_start_method() != "fork"
+        future = pool.submit(time.sleep, 60)
+        deadline = time.monotonic() + 30
+        while not pool._processes:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        processes = list(pool._processes.values())
+        
+        terminate_pool_workers(pool)
+        for process in processes:
+            process.join(timeout=10)
+            assert not process.is_alive()
+        # The running task fails instead of leaving its caller waiting
+        assert isinstance(future.exception(timeout=10), BrokenProcessPool)
+    finally:
+        get_extraction_process_pool.clear()
@@ -0,0 +1,20 @@
+import decoder_universe
+from decoder_universe import scan_document_for_red_flags
+
+def matches(text, decoder_type):
+    return [finding["match"] for finding in scan_document_for_red_flags(text, [decoder_type])]
+
+def test_patterns_do_not_match_inside_longer_words():
+    assert matches("Signed before the commissioner of deeds, witnessed by the nitrogenous plant's docs.", "financial_advisor") == []
+    assert matches("The commissioner approved the Nitrogenic line; see the dealer's handbook.", "car_salesman") == []
+    assert matches("A subcommission was filed with the Transaction Brokerage Board.", "real_estate") == []
+
+def test_whole_words_and_plurals_still_match():
+    assert matches("Advisors earn commissions and referral bonuses.", "financial_advisor") == ["commissions", "referral bonuses"]
+    assert matches("Dealer prep fees apply; tires are filled with nitrogen.", "car_salesman") == ["Dealer prep fees", "nitrogen"]
+    assert matches("Non-refundable deposits and brokerage fees.", "real_estate") == ["Non-refundable deposits", "brokerage fees"]
+
+def test_every_decoder_pattern_is_bounded_by_word_boundaries():
+    for decoder_type in decoder_universe.DECODERS:
+        for rule in decoder_universe.DECODERS[decoder_type].get("scan_patterns", []):
+            assert rule["pattern"].startswith(r"\b") and rule["pattern"].endswith(r"\b"), rule["pattern"]
@@ -0,0 +1,18 @@
+import os
+import stat
+
+from decoder_universe import connect_private_sqlite
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def test_databases_are_private_to_the_app_user(tmp_path):
+    path = tmp_path / "data" / "history.sqlite3"
+    connect_private_sqlite(str(path)).close()
+    assert mode(path.parent) == 0o700
+    assert mode(path) == 0o600
+    
+    # Files left over with umask permissions are tightened
+    os.chmod(path, 0o644)
+    connect_private_sqlite(str(path)).close()
+    assert mode(path) == 0o600
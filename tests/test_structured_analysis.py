@@ -0,0 +1,38 @@
+import json
+
+from decoder_universe import parse_structured_analysis, render_structured_analysis
+
+def lines(*items):
+    return "\n".join(json.dumps(item) for item in items)
+
+def test_percentages_are_not_dollar_amounts():
+    analysis = parse_structured_analysis(lines(
+        {"type": "fee", "item": "Advisory fee", "amount": "1%", "quote": ""},
+        {"type": "fee", "item": "Surrender charge", "amount": None, "percent": 7, "quote": ""},
+        {"type": "fee", "item": "Documentation fee", "amount": "$1,295.00", "quote": ""},
+    ))
+    advisory, surrender, documentation = analysis["fees"]
+    assert (advisory["amount"], advisory["percent"]) == (None, 1.0)
+    assert (surrender["amount"], surrender["percent"]) == (None, 7.0)
+    assert (documentation["amount"], documentation["percent"]) == (1295.0, None)
+    
+    report = render_structured_analysis(analysis)
+    assert "**Advisory fee**: 1%" in report
+    assert "**Documentation fee**: \\$1,295" in report
+
+def test_quotes_are_checked_against_the_document():
+    document = "Buyer agrees to pay a documentation fee of $799 at signing."
+    analysis = parse_structured_analysis(lines(
+        {"type": "red_flag", "description": "Fee", "severity": "HIGH", "quote": "documentation  FEE of $799"},
+        {"type": "red_flag", "description": "Invented", "severity": "low", "quote": "non-refundable deposit"},
+    ), document)
+    assert [flag["verified"] for flag in analysis["red_flags"]] == [True, False]
+    assert analysis["red_flags"][0]["severity"] == "high"
+
+def test_malformed_lines_are_dropped_or_kept_as_notes():
+    analysis = parse_structured_analysis(lines({"type": "fee"}) + "\nError analyzing document: timeout\n{\"type\": \"summ")
+    assert analysis["invalid_items"] == 1
+    assert analysis["notes"] == ["Error analyzing document: timeout", '{"type": "summ']
+    
+    streaming = parse_structured_analysis('{"type": "summary", "text": "Done"}\n{"type": "summ', complete=False)
+    assert streaming["summary"] == "Done" and not streaming["notes"]
@@ -0,0 +1,41 @@
+from decoder_universe import PAGE_BREAK, trim_document_text
+
+def pages(*texts):
+    return PAGE_BREAK.join(texts) + PAGE_BREAK
+
+def test_amounts_on_their_own_line_are_kept():
+    text = pages(
+        "ACME MOTORS - BUYER'S ORDER\nDocumentation fee\n499\nDealer preparation\n1295\nModel year\n2024\n1",
+        "ACME MOTORS - BUYER'S ORDER\nVIN etching\n$799\n2",
+    )
+    trimmed = trim_document_text(text)
+    for amount in ("499", "1295", "2024", "$799"):
+        assert amount in trimmed.splitlines()
+
+def test_payment_schedule_lines_are_not_merged():
+    schedule = "\n".join(f"Monthly payment {number}: ${amount}" for number, amount in ((1, 350), (2, 350), (3, 410), (4, 410)))
+    trimmed = trim_document_text(pages("Retail installment contract\n" + schedule + "\nSigned by buyer"))
+    for line in schedule.splitlines():
+        assert line in trimmed
+
+def test_repeated_clauses_in_the_body_are_kept():
+    clause = "Buyer agrees to pay a documentation fee of $499 at signing."
+    text = pages(*(f"Header\nItem {number}\n{clause}\nNotes {number}\nFooter" for number in range(5)))
+    assert trim_document_text(text).count(clause) == 5
+
+def test_page_numbers_and_running_headers_are_removed():
+    text = pages(*(f"ACME MOTORS CONFIDENTIAL\nClause {number} text\nMore text\nPage {number} of 4" for number in range(1, 5)))
+    trimmed = trim_document_text(text)
+    assert trimmed.count("ACME MOTORS CONFIDENTIAL") == 1
+    assert "of 4" not in trimmed
+    for number in range(1, 5):
+        assert f"Clause {number} text" in trimmed
+
+def test_bare_page_numbers_at_page_edges_are_removed():
+    text = pages(*(f"Clause {number}\nFee ${number}00\n{number}" for number in range(1, 4)))
+    assert trim_document_text(text).splitlines() == [
+        "Clause 1", "Fee $100", "", "Clause 2", "Fee $200", "", "Clause 3", "Fee $300"
+    ]
+
+def test_whitespace_is_normalized():
+    assert trim_document_text("Total   due:\t$1,295.00  \n\n\n\nSign here") == "Total due: $1,295.00\n\nSign here"